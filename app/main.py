@@ -1,9 +1,12 @@
 import fastapi
 from yoyo import read_migrations
 from yoyo import get_backend
-from .sensors.controller import router as sensorsRouter
+from .sensors.controller import router as sensorsRouter, get_spool_drainer, get_latest_table, INGEST_MODE
+from . import profiling
+from shared.serialization import ORJSONResponse
 
-app = fastapi.FastAPI(title="Senser", version="0.1.0-alpha.1")
+# orjson for every response; the routes returning large lists build an ORJSONResponse themselves
+app = fastapi.FastAPI(title="Senser", version="0.1.0-alpha.1", default_response_class=ORJSONResponse)
 
 #TODO: Apply new TS migrations using Yoyo
 #Read docs: https://ollycope.com/software/yoyo/latest/
@@ -23,7 +26,26 @@ with db.lock():
 
 app.include_router(sensorsRouter)
 
+@app.on_event("startup")
+def start_latest_table():
+    #the listener has to be subscribed before the table serves anything
+    get_latest_table()
+
+@app.on_event("startup")
+def start_spool_drainer():
+    #forward what was left in the spool before the restart without waiting for new requests
+    if INGEST_MODE == "spool":
+        get_spool_drainer()
+profiling.install(app)
+
 @app.get("/")
 def index():
     #Return the api name and version
     return {"name": app.title, "version": app.version}
+
+@app.get("/spool")
+def spool_metrics():
+    #Return the depth and drain rate of this worker's spool
+    if INGEST_MODE != "spool":
+        return {"enabled": False}
+    return {"enabled": True, **get_spool_drainer().metrics()}
@@ -0,0 +1,84 @@
+import asyncio
+import inspect
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+from shared.profiling import (PROFILING, PROFILE_SLOW_MS, Profile, ReportRing, attach_thread, current,
+                              get_sampler, instrument_clients, should_profile)
+
+ring = ReportRing() if PROFILING else None
+
+
+def attachable(call):
+    # include_router creates the routes again: don't wrap twice
+    return not (asyncio.iscoroutinefunction(call) or inspect.isasyncgenfunction(call) or getattr(call, "attached", False))
+
+
+def attach_dependencies(dependant):
+    for dependency in dependant.dependencies:
+        if dependency.call is not None and attachable(dependency.call):
+            dependency.call = attach_thread(dependency.call)
+        attach_dependencies(dependency)
+
+
+class ProfiledRoute(APIRoute):
+    # Sync routes and dependencies run in threadpool threads (often different ones):
+    # register each thread so the sampler finds it. That way the time spent opening
+    # connections in get_db, get_cassandra_client... shows up too
+    def __init__(self, path, endpoint, **kwargs):
+        if attachable(endpoint):
+            endpoint = attach_thread(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+        attach_dependencies(self.dependant)
+
+
+route_class = ProfiledRoute if PROFILING else APIRoute
+
+router = APIRouter(
+    prefix="/profiles",
+    tags=["profiles"],
+)
+
+
+@router.get("")
+def list_profiles():
+    return {"profiles": ring.list()}
+
+
+@router.get("/{profile_id}")
+def get_profile(profile_id: str):
+    report = ring.get(profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return JSONResponse(report, headers={"Content-Disposition": f'attachment; filename="{profile_id}.json"'})
+
+
+async def profile_requests(request: Request, call_next):
+    # Profile if the request sends "X-Profile: 1" or falls in the PROFILE_SAMPLE_RATE sample;
+    # the report is kept if it was forced or took longer than PROFILE_SLOW_MS
+    forced = request.headers.get("x-profile") == "1"
+    if not should_profile(forced):
+        return await call_next(request)
+    profile = Profile(f"{request.method} {request.url.path}", forced=forced)
+    token = current.set(profile)
+    get_sampler().add(profile)
+    try:
+        response = await call_next(request)
+    finally:
+        get_sampler().remove(profile)
+        current.reset(token)
+        profile.finish()
+    if forced or profile.duration_ms >= PROFILE_SLOW_MS:
+        ring.save(profile)
+        response.headers["X-Profile-Id"] = profile.id
+    return response
+
+
+def install(app):
+    if not PROFILING:
+        return
+    instrument_clients()
+    app.middleware("http")(profile_requests)
+    app.include_router(router)
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from shared.database import SessionLocal
@@ -7,10 +8,28 @@ from shared.mongodb_client import MongoDBClient
 from shared.elasticsearch_client import ElasticsearchClient 
 from shared.timescale import Timescale
 from shared.cassandra_client import CassandraClient
+from shared.cache import ResultCache
+from shared.serialization import ORJSONResponse, dumps
+from shared.publisher import Publisher
+from shared.spool import Spool, SpoolDrainer, claim_directory, claim_orphans
+from shared.latest_table import LatestTable, start_listener
 from shared.sensors import models, schemas, repository
+from app.profiling import route_class
 
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
+import os
+import threading
+
+# "direct" writes each reading to the databases inside the request (so a reading
+# can be queried as soon as the POST returns), "queue" publishes it to the sensor's
+# partition for the consumers to write and "spool" appends it to the local spool,
+# which a background thread forwards to RabbitMQ
+INGEST_MODE = os.environ.get("INGEST_MODE", "direct")
+SPOOL_DIR = os.environ.get("SPOOL_DIR", "spool")
+# If set, the workers on this host share the latest readings through this file
+LATEST_TABLE_PATH = os.environ.get("LATEST_TABLE_PATH")
+LATEST_TABLE_CAPACITY = int(os.environ.get("LATEST_TABLE_CAPACITY", 100_000))
 
 # Dependency to get db session
 def get_db():
@@ -59,9 +78,61 @@ def get_cassandra_client():
     finally:
         cassandra.close()
 
+# Dependency to get a RabbitMQ publisher
+def get_publisher():
+    publisher = Publisher()
+    try:
+        yield publisher
+    finally:
+        publisher.close()
+
+# The spool and its drainer are shared by every request of this worker process
+spool_drainer = None
+singleton_lock = threading.Lock()
+
+def get_spool_drainer():
+    global spool_drainer
+    with singleton_lock:
+        if spool_drainer is None:
+            directory, lock = claim_directory(SPOOL_DIR)
+            spool_drainer = SpoolDrainer(Spool(directory, lock=lock), connect=Publisher)
+            spool_drainer.start()
+            for directory, lock in claim_orphans(SPOOL_DIR):
+                SpoolDrainer(Spool(directory, lock=lock), connect=Publisher, until_empty=True).start()
+    return spool_drainer
+
+# A single broker connection per worker process for INGEST_MODE=queue; pika connections are not thread safe
+publisher = None
+publisher_lock = threading.Lock()
+
+def publish_reading(sensor_id: int, data: schemas.SensorData):
+    global publisher
+    with publisher_lock:
+        try:
+            if publisher is None:
+                publisher = Publisher()
+            publisher.publish(data, sensor_id=sensor_id)
+        except Exception:
+            publisher = None
+            raise HTTPException(status_code=503, detail="Broker unavailable")
+
+# Shared-memory latest readings, kept current from Redis pub/sub
+latest_table = None
+
+def get_latest_table():
+    global latest_table
+    if LATEST_TABLE_PATH is None:
+        return None
+    with singleton_lock:
+        if latest_table is None:
+            latest_table = LatestTable(LATEST_TABLE_PATH, capacity=LATEST_TABLE_CAPACITY)
+            start_listener(latest_table, redis_host="redis")
+    return latest_table
+
 
 router = APIRouter(
     prefix="/sensors",
+    route_class=route_class,
     responses={404: {"description": "Not found"}},
     tags=["sensors"],
 )
@@ -75,6 +146,18 @@ def get_sensors_near(latitude: float, longitude: float, radius: int, db: Session
 
 
 
+# Readings of many sensors in a single Timescale query, aggregated per sensor and for the whole fleet
+# Parameters:
+# - ids (optional): sensor ids, can be repeated
+# - type (optional): sensor type, alone or restricting ids
+# - from_date / to (optional): time range
+# - bucket (optional): bucket width like 15m, 1h or 1d; without it the whole range is one bucket
+# - fields (optional): comma separated readings to aggregate
+@router.get("/data")
+def get_fleet_data(ids: Optional[List[int]] = Query(None), sensor_type: Optional[str] = Query(None, alias="type"), from_date: Optional[datetime] = None, to: Optional[datetime] = None, bucket: Optional[str] = None, fields: str = ",".join(repository.DATA_FIELDS), mongodb_client: MongoDBClient = Depends(get_mongodb_client), timescale: Timescale = Depends(get_timescale)):
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    return ORJSONResponse(repository.get_fleet_data(ts=timescale, mongodb=mongodb_client, sensor_ids=ids, sensor_type=sensor_type, from_date=from_date, to_date=to, bucket=bucket, fields=selected))
+
 # 🙋🏽‍♀️ Add here the route to search sensors by query to Elasticsearch
 # Parameters:
 # - query: string to search
@@ -89,25 +172,42 @@ def search_sensors(query: str, size: int = 10, search_type: str = "match", db: S
 
 # 🙋🏽‍♀️ Add here the route to get the temperature values of a sensor
 
+# Serve an analytics result from the Redis cache, with an ETag and 304 if the client already has it
+def cached_response(request: Request, redis: RedisClient, name: str, compute) -> Response:
+    entry = ResultCache(redis).get(name, lambda: dumps(compute()).decode())
+    headers = {"ETag": entry["etag"]}
+    if_none_match = request.headers.get("if-none-match", "")
+    if entry["etag"] in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
+
 @router.get("/temperature/values")
-def get_temperature_values(db: Session = Depends(get_db), cassandra_client: CassandraClient = Depends(get_cassandra_client), mongodb_client: MongoDBClient = Depends(get_mongodb_client)):
+def get_temperature_values(request: Request, db: Session = Depends(get_db), cassandra_client: CassandraClient = Depends(get_cassandra_client), mongodb_client: MongoDBClient = Depends(get_mongodb_client), redis_client: RedisClient = Depends(get_redis_client)):
     #raise HTTPException(status_code=404, detail="Not implemented")
-    return repository.get_temperature_values(db=db, cassandra=cassandra_client, mongodb=mongodb_client)
+    return cached_response(request, redis_client, "temperature_values", lambda: repository.get_temperature_values(db=db, cassandra=cassandra_client, mongodb=mongodb_client))
 
 @router.get("/quantity_by_type")
-def get_sensors_quantity(db: Session = Depends(get_db), cassandra_client: CassandraClient = Depends(get_cassandra_client)):
+def get_sensors_quantity(request: Request, db: Session = Depends(get_db), cassandra_client: CassandraClient = Depends(get_cassandra_client), redis_client: RedisClient = Depends(get_redis_client)):
     #raise HTTPException(status_code=404, detail="Not implemented")
-    return repository.get_sensors_quantity(db=db, cassandra=cassandra_client)
+    return cached_response(request, redis_client, "quantity_by_type", lambda: repository.get_sensors_quantity(db=db, cassandra=cassandra_client))
 
 @router.get("/low_battery")
-def get_low_battery_sensors(db: Session = Depends(get_db), cassandra_client: CassandraClient = Depends(get_cassandra_client), mongodb_client: MongoDBClient = Depends(get_mongodb_client)):
+def get_low_battery_sensors(request: Request, db: Session = Depends(get_db), cassandra_client: CassandraClient = Depends(get_cassandra_client), mongodb_client: MongoDBClient = Depends(get_mongodb_client), redis_client: RedisClient = Depends(get_redis_client)):
     #raise HTTPException(status_code=404, detail="Not implemented")
-    return repository.get_low_battery_sensors(db=db, cassandra=cassandra_client, mongodb=mongodb_client)
+    return cached_response(request, redis_client, "low_battery", lambda: repository.get_low_battery_sensors(db=db, cassandra=cassandra_client, mongodb=mongodb_client))
 
 # 🙋🏽‍♀️ Add here the route to get all sensors
+# - limit: number of sensors per page
+# - cursor (optional): next_cursor returned by the previous page
+# - fields (optional): comma separated fields to return, only id/name/joined_at avoid MongoDB
+# - stream (optional): return every sensor as newline delimited JSON
 @router.get("")
-def get_sensors(db: Session = Depends(get_db)):
-    return repository.get_sensors(db)
+def get_sensors(limit: int = Query(100, ge=1, le=1000), cursor: Optional[str] = None, fields: Optional[str] = None, stream: bool = False, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client)):
+    selected = repository.parse_fields(fields)
+    if stream:
+        lines = (dumps(sensor) + b"\n" for sensor in repository.iter_sensors(db=db, mongodb=mongodb_client, fields=selected))
+        return StreamingResponse(lines, media_type="application/x-ndjson")
+    return ORJSONResponse(repository.get_sensors_page(db=db, mongodb=mongodb_client, limit=limit, cursor=cursor, fields=selected))
 
 
 # 🙋🏽‍♀️ Add here the route to create a sensor
@@ -119,6 +219,12 @@ def create_sensor(sensor: schemas.SensorCreate, db: Session = Depends(get_db), m
     #raise HTTPException(status_code=404, detail="Not implemented")
     return repository.create_sensor(sensor=sensor, db=db, mongodb=mongodb_client, es=es)
 
+# Progress of the background purge started by deleting a sensor: current step,
+# rows/documents/partitions deleted and bytes reclaimed per store
+@router.get("/purge/{job_id}")
+def get_purge_job(job_id: str, redis_client: RedisClient = Depends(get_redis_client)):
+    return repository.get_purge_job(redis=redis_client, job_id=job_id)
+
 # 🙋🏽‍♀️ Add here the route to get a sensor by id
 @router.get("/{sensor_id}")
 def get_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client)):
@@ -128,22 +234,47 @@ def get_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client: Mo
     return db_sensor
 
 # 🙋🏽‍♀️ Add here the route to delete a sensor
-@router.delete("/{sensor_id}")
-def delete_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client)):
-    db_sensor = repository.get_sensor(db, sensor_id)
-    if db_sensor is None:
-        raise HTTPException(status_code=404, detail="Sensor not found")
+# The Postgres row goes away at once; the other stores are purged by the consumers in the background
+@router.delete("/{sensor_id}", status_code=202)
+def delete_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), redis_client: RedisClient = Depends(get_redis_client), publisher: Publisher = Depends(get_publisher)):
     #raise HTTPException(status_code=404, detail="Not implemented")
-    return repository.delete_sensor(db=db, sensor_id=sensor_id)
+    return repository.delete_sensor(db=db, sensor_id=sensor_id, mongodb=mongodb_client, redis=redis_client, publisher=publisher)
     
-@router.post("/{sensor_id}/data")
-def record_data(sensor_id: int, data: schemas.SensorData,db: Session = Depends(get_db) ,redis_client: RedisClient = Depends(get_redis_client), mongodb_client: MongoDBClient = Depends(get_mongodb_client),timescale: Timescale = Depends(get_timescale), cassandra: CassandraClient = Depends(get_cassandra_client)):
-    #raise HTTPException(status_code=404, detail="Not implemented")
-    return repository.record_data(db=db, redis=redis_client, sensor_id=sensor_id, data=data, mongodb=mongodb_client, ts=timescale, cassandra = cassandra)
+if INGEST_MODE == "spool":
+    # No database connection at all: the reading is only appended to the spool.
+    # SensorData has already validated last_seen (422 if it is not ISO 8601), so no poison messages get in
+    @router.post("/{sensor_id}/data", status_code=202)
+    def record_data(sensor_id: int, data: schemas.SensorData):
+        get_spool_drainer().reader.spool.append(sensor_id, data.json().encode())
+        return {"id": sensor_id, "status": "accepted"}
+elif INGEST_MODE == "queue":
+    @router.post("/{sensor_id}/data", status_code=202)
+    def record_data(sensor_id: int, data: schemas.SensorData):
+        publish_reading(sensor_id, data)
+        return {"id": sensor_id, "status": "accepted"}
+else:
+    @router.post("/{sensor_id}/data")
+    def record_data(sensor_id: int, data: schemas.SensorData,db: Session = Depends(get_db) ,redis_client: RedisClient = Depends(get_redis_client), mongodb_client: MongoDBClient = Depends(get_mongodb_client),timescale: Timescale = Depends(get_timescale), cassandra: CassandraClient = Depends(get_cassandra_client)):
+        #raise HTTPException(status_code=404, detail="Not implemented")
+        return repository.record_data(db=db, redis=redis_client, sensor_id=sensor_id, data=data, mongodb=mongodb_client, ts=timescale, cassandra = cassandra)
+
+@router.get("/{sensor_id}/latest")
+def get_latest(sensor_id: int, redis_client: RedisClient = Depends(get_redis_client), table: Optional[LatestTable] = Depends(get_latest_table)):
+    return repository.get_latest(redis=redis_client, sensor_id=sensor_id, table=table)
+
+# Temperature readings of a sensor between two dates, read from the daily Cassandra partitions
+@router.get("/{sensor_id}/temperature")
+def get_temperature_range(sensor_id: int, from_date: datetime, to: datetime, cassandra_client: CassandraClient = Depends(get_cassandra_client)):
+    return ORJSONResponse(repository.get_temperature_range(cassandra=cassandra_client, sensor_id=sensor_id, from_date=from_date, to_date=to))
 
+# - max_points (optional): downsample on the server to at most this many readings
+# - downsample (optional): "lttb" or "minmax"
+# - field (optional): reading used to choose the points kept, by default the first one the sensor reports
 @router.get("/{sensor_id}/data")
-def get_data(sensor_id: int,from_date: Optional[datetime] = None, to: Optional[datetime] = None, bucket: Optional[str] = None,db: Session = Depends(get_db) ,redis_client: RedisClient = Depends(get_redis_client), mongodb_client: MongoDBClient = Depends(get_mongodb_client),timescale: Timescale = Depends(get_timescale)):    
+def get_data(sensor_id: int,from_date: Optional[datetime] = None, to: Optional[datetime] = None, bucket: Optional[str] = None, max_points: Optional[int] = Query(None, ge=3), downsample: str = "lttb", field: Optional[str] = None, db: Session = Depends(get_db) ,redis_client: RedisClient = Depends(get_redis_client), mongodb_client: MongoDBClient = Depends(get_mongodb_client),timescale: Timescale = Depends(get_timescale)):    
     #raise HTTPException(status_code=404, detail="Not implemented")
+    if max_points is not None:
+        return ORJSONResponse(repository.get_data_downsampled(ts=timescale, sensor_id=sensor_id, from_date=from_date, to_date=to, max_points=max_points, method=downsample, field=field))
     return repository.get_data(sensor_id=sensor_id, ts=timescale, from_date=from_date, to_date=to, bucket=bucket, mongodb=mongodb_client, db=db, redis=redis_client)
 
 
@@ -63,6 +63,15 @@ def test_create_sensor_temperatura_2():
     assert response.status_code == 200
     assert response.json() == {"id": 4, "name": "Sensor Temperatura 2", "latitude": 2.0, "longitude": 2.0, "type": "Temperatura", "mac_address": "00:00:00:00:00:03", "manufacturer": "Dummy", "model":"Dummy Temp", "serie_number": "0000 0000 0000 0000", "firmware_version": "1.0", "description": "Sensor de temperatura model Dummy Temp del fabricant Dummy"}
 
+def test_get_sensors_keyset_pagination():
+    response = client.get("/sensors?limit=3&fields=id,name")
+    assert response.status_code == 200
+    page = response.json()
+    assert page["sensors"] == [{"id": 1, "name": "Sensor Temperatura 1"}, {"id": 2, "name": "Velocitat 1"}, {"id": 3, "name": "Velocitat 2"}]
+    response = client.get("/sensors", params={"limit": 3, "fields": "id,name", "cursor": page["next_cursor"]})
+    assert response.status_code == 200
+    assert response.json() == {"sensors": [{"id": 4, "name": "Sensor Temperatura 2"}], "next_cursor": None}
+
 def test_post_sensor_data_temperatura_1():
     response = client.post("/sensors/1/data", json={"temperature": 1.0, "humidity": 1.0, "battery_level": 1.0, "last_seen": "2020-01-01T00:00:00.000Z"})
     assert response.status_code == 200
@@ -88,10 +97,52 @@ def test_post_sensor_data_veolicitat_2():
     response = client.post("/sensors/3/data", json={"velocity": 15.0, "battery_level": 0.15, "last_seen": "2020-01-01T01:00:00.000Z"})
     assert response.status_code == 200
 
+def test_get_sensor_data_downsampled():
+    response = client.get("/sensors/1/data?max_points=3")
+    assert response.status_code == 200
+    assert response.json() == [{"last_seen": "2020-01-01T00:00:00.000000", "temperature": 1.0, "humidity": 1.0, "velocity": None, "battery_level": 1.0}, {"last_seen": "2020-01-01T01:00:00.000000", "temperature": 4.0, "humidity": 1.0, "velocity": None, "battery_level": 1.0}]
+
+def test_post_sensor_data_invalid_last_seen():
+    response = client.post("/sensors/1/data", json={"temperature": 1.0, "humidity": 1.0, "battery_level": 1.0, "last_seen": "yesterday"})
+    assert response.status_code == 422
+
+def test_get_sensor_data_downsampled_velocity():
+    response = client.get("/sensors/2/data?max_points=3")
+    assert response.status_code == 200
+    assert response.json() == [{"last_seen": "2020-01-01T00:00:00.000000", "temperature": None, "humidity": None, "velocity": 1.0, "battery_level": 0.1}]
+    response = client.get("/sensors/2/data?max_points=3&field=temperature")
+    assert response.status_code == 400
+
+def test_get_fleet_data():
+    response = client.get("/sensors/data?ids=1&ids=4&fields=temperature")
+    assert response.status_code == 200
+    assert response.json() == {"bucket": None,
+                               "sensors": {"id": [1, 4], "count": [2, 2], "temperature_avg": [2.5, 16.0], "temperature_min": [1.0, 15.0], "temperature_max": [4.0, 17.0]},
+                               "fleet": {"count": [4], "temperature_avg": [9.25], "temperature_min": [1.0], "temperature_max": [17.0]}}
+
+def test_get_temperature_range():
+    response = client.get("/sensors/4/temperature?from_date=2020-01-01T12:00:00&to=2020-01-02T00:30:00")
+    assert response.status_code == 200
+    assert response.json() == {"id": 4, "readings": [{"last_seen": "2020-01-02T00:00:00", "temperature": 15.0}]}
+
+def test_get_temperature_range_mixed_timezones():
+    response = client.get("/sensors/4/temperature?from_date=2020-01-01T12:00:00Z&to=2020-01-02T00:30:00")
+    assert response.status_code == 200
+    assert response.json() == {"id": 4, "readings": [{"last_seen": "2020-01-02T00:00:00", "temperature": 15.0}]}
+
 def test_get_values_sensor_temperatura():
     response = client.get("/sensors/temperature/values")
     assert response.status_code == 200
     assert response.json() == {"sensors": [{"id": 1, "name": "Sensor Temperatura 1", "latitude": 1.0, "longitude": 1.0, "type": "Temperatura", "mac_address": "00:00:00:00:00:00", "manufacturer": "Dummy", "model":"Dummy Temp", "serie_number": "0000 0000 0000 0000", "firmware_version": "1.0", "description": "Sensor de temperatura model Dummy Temp del fabricant Dummy", "values": [{"max_temperature": 4.0, "min_temperature": 1.0, "average_temperature": 2.5}]}, {"id": 4, "name": "Sensor Temperatura 2", "latitude": 2.0, "longitude": 2.0, "type": "Temperatura", "mac_address": "00:00:00:00:00:03", "manufacturer": "Dummy", "model":"Dummy Temp", "serie_number": "0000 0000 0000 0000", "firmware_version": "1.0", "description": "Sensor de temperatura model Dummy Temp del fabricant Dummy", "values": [{"max_temperature": 17.0, "min_temperature": 15.0, "average_temperature": 16.0}]}]}
+
+def test_get_values_sensor_temperatura_not_modified():
+    response = client.get("/sensors/temperature/values")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    response = client.get("/sensors/temperature/values", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
 def test_get_sensors_quantity():
     response = client.get("/sensors/quantity_by_type")
     assert response.status_code == 200
@@ -102,3 +153,22 @@ def test_get_sensors_low_battery():
     assert response.status_code == 200
     assert response.json() == {"sensors": [{"id": 2, "name": "Velocitat 1", "latitude": 1.0, "longitude": 1.0, "type": "Velocitat", "mac_address": "00:00:00:00:00:01", "manufacturer": "Dummy", "model":"Dummy Vel", "serie_number": "0000 0000 0000 0000", "firmware_version": "1.0", "description": "Sensor de velocitat model Dummy Vel del fabricant Dummy cruïlla 1", "battery_level": 0.1}, {"id": 3, "name": "Velocitat 2", "latitude": 2.0, "longitude": 2.0, "type": "Velocitat", "mac_address": "00:00:00:00:00:02", "manufacturer": "Dummy", "model":"Dummy Vel", "serie_number": "0000 0000 0000 0000", "firmware_version": "1.0", "description": "Sensor de velocitat model Dummy Vel del fabricant Dummy cruïlla 2", "battery_level": 0.15}]}
 
+
+def test_delete_sensor():
+    response = client.post("/sensors", json={"name": "Sensor Esborrat", "latitude": 3.0, "longitude": 3.0, "type": "Temperatura", "mac_address": "00:00:00:00:00:09", "manufacturer": "Dummy", "model":"Dummy Temp", "serie_number": "0000 0000 0000 0000", "firmware_version": "1.0", "description": "Sensor per esborrar"})
+    assert response.status_code == 200
+    sensor_id = response.json()["id"]
+    response = client.delete(f"/sensors/{sensor_id}")
+    assert response.status_code == 202
+    job = response.json()
+    assert job["id"] == sensor_id
+    assert job["status"] == "queued"
+    response = client.get(f"/sensors/purge/{job['job_id']}")
+    assert response.status_code == 200
+    assert response.json()["sensor_id"] == sensor_id
+    response = client.delete(f"/sensors/{sensor_id}")
+    assert response.status_code == 404
+
+def test_get_purge_job_not_found():
+    response = client.get("/sensors/purge/unknown")
+    assert response.status_code == 404
@@ -0,0 +1,89 @@
+"""Latència i mida de la resposta de GET /sensors/{id}/data amb i sense max_points.
+
+Mesura el que fa l'API un cop Timescale ha retornat les files: get_fleet_columns
+passant les tuples a columnes NumPy i després totes les lectures (raw) o els punts
+de LTTB / min-max com la llista d'objectes que retorna la ruta, serialitzats amb
+el mateix encoder orjson que ORJSONResponse.
+
+Amb --source fake les files són tuples sintètiques com les de psycopg2
+(id, datetime, temperature, humidity, velocity, battery_level) i fetchall no
+costa res; amb --source timescale la consulta va a la base de dades TS_*, així
+també es compta la lectura.
+
+    python -m benchmarks.downsampling --rows 10000000 --max-points 1000
+    python -m benchmarks.downsampling --source timescale --sensor-id 1
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+from shared.sensors import repository
+from shared.serialization import dumps, reading_rows
+
+
+class RowsTimescale:
+    # Retorna sempre les mateixes files, com ho faria cursor.fetchall()
+    def __init__(self, rows):
+        self.cursor = SimpleNamespace(fetchall=lambda: rows)
+
+    def execute(self, query, params=None):
+        pass
+
+
+def synthetic_rows(rows, sensor_id=1, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(rows, dtype=np.float64)
+    temperature = (20 + 5 * np.sin(t / 86_400 * 2 * np.pi) + rng.normal(0, 0.5, rows)).tolist()
+    humidity = rng.uniform(30, 70, rows).tolist()
+    battery = rng.uniform(0, 1, rows).tolist()
+    start = datetime(2020, 1, 1)
+    return [(sensor_id, start + timedelta(seconds=i), temperature[i], humidity[i], None, battery[i]) for i in range(rows)]
+
+
+def raw(ts, sensor_id):
+    columns = repository.get_data_columns(ts=ts, sensor_id=sensor_id, from_date=None, to_date=None)
+    return dumps(reading_rows(columns.pop("last_seen"), columns))
+
+
+def downsampled(ts, sensor_id, max_points, method):
+    return dumps(repository.get_data_downsampled(ts=ts, sensor_id=sensor_id, from_date=None, to_date=None,
+                                                 max_points=max_points, method=method))
+
+
+def timed(fn):
+    start = time.perf_counter()
+    body = fn()
+    return time.perf_counter() - start, len(body)
+
+
+def run(ts, sensor_id, max_points):
+    results = [("raw", *timed(lambda: raw(ts, sensor_id)))]
+    for method in ("lttb", "minmax"):
+        results.append((method, *timed(lambda: downsampled(ts, sensor_id, max_points, method))))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", choices=["fake", "timescale"], default="fake")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--sensor-id", type=int, default=1)
+    parser.add_argument("--max-points", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.source == "fake":
+        ts = RowsTimescale(synthetic_rows(args.rows, args.sensor_id))
+    else:
+        from shared.timescale import Timescale
+        ts = Timescale()
+
+    print(f"{'path':<8} {'latency (s)':>12} {'size (bytes)':>14}")
+    for name, seconds, size in run(ts, args.sensor_id, args.max_points):
+        print(f"{name:<8} {seconds:>12.3f} {size:>14}")
+
+
+if __name__ == "__main__":
+    main()
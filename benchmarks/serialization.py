@@ -0,0 +1,117 @@
+"""Temps de CPU per resposta de les rutes de llistes, amb la serialització antiga i amb orjson.
+
+Construeix contingut de 10k files amb les formes que retorna l'API (una pàgina de
+sensors, les lectures de GET /sensors/{id}/data i els agregats en columnes de
+GET /sensors/data) i mesura, per a cadascun, construir-lo i convertir-lo en el
+cos de la resposta: el camí actual és jsonable_encoder més el json de la
+biblioteca estàndard (el que fa FastAPI amb un dict retornat), el nou els
+encoders lleugers més orjson.
+
+    python -m benchmarks.serialization --rows 10000 --repeat 20
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+
+from shared.sensors.aggregation import aggregate_fleet, group_aggregate
+from shared.serialization import dumps, format_joined_at, reading_rows
+
+FIELDS = ["temperature", "humidity", "velocity", "battery_level"]
+
+
+def starlette_json(content):
+    # Mateixos paràmetres que JSONResponse.render
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def synthetic_rows(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    last_seen = np.datetime64("2020-01-01T00:00:00", "us") + np.arange(rows, dtype=np.int64) * 60_000_000
+    columns = {field: rng.normal(20, 5, rows) for field in FIELDS}
+    columns["velocity"][::3] = np.nan
+    return last_seen, columns
+
+
+def sensors_old(rows):
+    return {"sensors": [{"id": sensor_id, "name": name, "joined_at": joined_at.strftime("%m/%d/%Y, %H:%M:%S")} for sensor_id, name, joined_at in rows],
+            "next_cursor": None}
+
+
+def sensors_new(rows):
+    return {"sensors": [{"id": sensor_id, "name": name, "joined_at": format_joined_at(joined_at)} for sensor_id, name, joined_at in rows],
+            "next_cursor": None}
+
+
+def readings_old(last_seen, columns):
+    points = {"last_seen": np.datetime_as_string(last_seen).tolist()}
+    for name in FIELDS:
+        points[name] = np.where(np.isnan(columns[name]), None, columns[name]).tolist()
+    return [dict(zip(points, row)) for row in zip(*points.values())]
+
+
+def aggregates_old(ids, last_seen, columns):
+    def to_column(values):
+        if np.issubdtype(values.dtype, np.datetime64):
+            return np.datetime_as_string(values).tolist()
+        if np.issubdtype(values.dtype, np.floating):
+            return np.where(np.isnan(values), None, values).tolist()
+        return values.tolist()
+    per_sensor = group_aggregate([ids], columns)
+    fleet = group_aggregate([np.zeros(len(ids), dtype=np.int64)], columns)
+    per_sensor = {"id": per_sensor.pop("key0"), **per_sensor}
+    fleet.pop("key0")
+    return {"sensors": {name: to_column(values) for name, values in per_sensor.items()},
+            "fleet": {name: to_column(values) for name, values in fleet.items()}}
+
+
+def payloads(rows):
+    last_seen, columns = synthetic_rows(rows)
+    sensor_rows = [(i, f"Sensor {i}", datetime(2024, 1, 1) + timedelta(seconds=i)) for i in range(rows)]
+    # Per als agregats, una fila de resultat per sensor: tants sensors com files
+    agg_ids = np.arange(rows, dtype=np.int64).repeat(4)
+    agg_seen = np.repeat(last_seen[:rows], 4)
+    agg_columns = {field: np.repeat(values, 4) for field, values in columns.items()}
+    return {
+        "sensors": (lambda: starlette_json(jsonable_encoder(sensors_old(sensor_rows))),
+                    lambda: dumps(sensors_new(sensor_rows))),
+        "readings": (lambda: starlette_json(jsonable_encoder(readings_old(last_seen, columns))),
+                     lambda: dumps(reading_rows(last_seen, columns))),
+        "aggregates": (lambda: starlette_json(jsonable_encoder(aggregates_old(agg_ids, agg_seen, agg_columns))),
+                       lambda: dumps(aggregate_fleet(agg_ids, agg_seen, agg_columns, None))),
+    }
+
+
+def cpu_time(fn, repeat):
+    body = fn()
+    start = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - start) / repeat, len(body)
+
+
+def run(rows, repeat):
+    results = []
+    for shape, (old, new) in payloads(rows).items():
+        old_seconds, old_size = cpu_time(old, repeat)
+        new_seconds, new_size = cpu_time(new, repeat)
+        results.append((shape, old_seconds, new_seconds, old_size, new_size))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'shape':<11} {'current (ms)':>13} {'orjson (ms)':>12} {'speedup':>8} {'size (bytes)':>14}")
+    for shape, old_seconds, new_seconds, old_size, new_size in run(args.rows, args.repeat):
+        print(f"{shape:<11} {old_seconds * 1000:>13.2f} {new_seconds * 1000:>12.2f} {old_seconds / new_seconds:>7.1f}x {new_size:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""Benchmark de rendiment del consumidor.
+
+Passa missatges SensorData sintètics pel Worker real al ritme indicat, des d'un
+substitut del broker en memòria, i els escriu a magatzems falsos en memòria
+(--sink fake) o a les bases de dades locals (--sink local).
+
+    python -m consumer.bench --messages 200000 --rate 0 --workers 2 --output bench_consumer.json
+
+Dona els msgs/s sostinguts, els percentils del retard d'extrem a extrem (de la
+publicació al flush), la latència de flush per magatzem i la CPU / memòria de
+cada worker, i ho desa en JSON.
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+from consumer.worker import Worker
+
+STORES = ["timescale", "cassandra", "redis"]
+
+
+class MemorySubscriber:
+    # Substitut del Subscriber de RabbitMQ: lliura els missatges d'una llista al
+    # ritme indicat amb la mateixa interfície (callback, batch, acks en flush)
+    def __init__(self, messages, rate=0):
+        self.messages = messages
+        self.rate = rate
+        self.published = defaultdict(int)
+        self.lags = []
+
+    def subscribe_partitions(self, callback, membership, interval=5, prefetch=1000, batch=None, flush_interval=1.0):
+        pending = []
+        channel = SimpleNamespace(basic_ack=lambda **kwargs: None)
+        start = last_flush = time.perf_counter()
+
+        def flush():
+            batch.flush()
+            now = time.perf_counter()
+            self.lags.extend(now - sent for sent in pending)
+            pending.clear()
+
+        for i, (sensor_id, body) in enumerate(self.messages):
+            if self.rate:
+                due = start + i / self.rate
+                while time.perf_counter() < due:
+                    if time.perf_counter() - last_flush >= flush_interval:
+                        flush()
+                        last_flush = time.perf_counter()
+                    time.sleep(min(0.001, max(0.0, due - time.perf_counter())))
+            sent = start + i / self.rate if self.rate else time.perf_counter()
+            callback(channel, SimpleNamespace(delivery_tag=i + 1), SimpleNamespace(headers={"sensor_id": sensor_id}), body)
+            pending.append(sent)
+            if batch.full() or time.perf_counter() - last_flush >= flush_interval:
+                flush()
+                last_flush = time.perf_counter()
+        flush()
+
+    def publish(self, queue, body):
+        self.published[queue] += 1
+
+    def close(self):
+        pass
+
+
+class Timed:
+    # Proxy que acumula el temps passat en qualsevol mètode del client
+    def __init__(self, target, timings, name):
+        self._target = target
+        self._timings = timings
+        self._name = name
+
+    def __getattr__(self, attr):
+        value = getattr(self._target, attr)
+        if not callable(value):
+            return Timed(value, self._timings, self._name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return value(*args, **kwargs)
+            finally:
+                self._timings[self._name] += time.perf_counter() - start
+        return timed
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(str(key))
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and str(key) in self.data:
+            return None
+        self.data[str(key)] = value
+        return True
+
+    def incr(self, key):
+        self.data[str(key)] = int(self.data.get(str(key), 0)) + 1
+        return self.data[str(key)]
+
+    def publish(self, channel, message):
+        return 0
+
+    def smembers(self, key):
+        return set()
+
+    def delete(self, key):
+        return self.data.pop(str(key), None) is not None
+
+    def keys(self, pattern):
+        return [key.encode() for key in self.data]
+
+
+class FakeTimescale:
+    def __init__(self):
+        self.rows = 0
+        self.conn = SimpleNamespace(commit=lambda: None)
+
+    def execute(self, query, params=None):
+        self.rows += query.count("), (") + 1
+
+
+class FakeCassandra:
+    def __init__(self):
+        self.statements = 0
+
+    def create_tables(self):
+        pass
+
+    def execute(self, query):
+        self.statements += 1
+
+
+class FakeMongoDB:
+    def get(self, query={}):
+        return {"id": query.get("id"), "type": "Temperatura"}
+
+
+def sinks(kind):
+    if kind == "fake":
+        return FakeRedis(), FakeTimescale(), FakeCassandra()
+    from shared.redis_client import RedisClient
+    from shared.timescale import Timescale
+    from shared.cassandra_client import CassandraClient
+    return RedisClient(host="localhost"), Timescale(), CassandraClient(hosts=["localhost"])
+
+
+def synthetic_messages(count, sensor_ids, seed=0):
+    rng = np.random.default_rng(seed)
+    start = datetime(2020, 1, 1)
+    ids = rng.choice(sensor_ids, size=count)
+    temperature = rng.normal(22, 3, count)
+    humidity = rng.uniform(30, 70, count)
+    battery = rng.uniform(0, 1, count)
+    return [
+        (int(ids[i]), json.dumps({"velocity": None, "temperature": float(temperature[i]), "humidity": float(humidity[i]),
+                                  "battery_level": float(battery[i]),
+                                  "last_seen": (start + timedelta(milliseconds=i)).isoformat(timespec="milliseconds") + "Z"}))
+        for i in range(count)
+    ]
+
+
+def run_worker(index, args):
+    sensor_ids = [sensor_id for sensor_id in range(1, args.sensors + 1) if sensor_id % args.workers == index]
+    messages = synthetic_messages(args.messages // args.workers, sensor_ids, seed=index)
+    timings = defaultdict(float)
+    redis, ts, cassandra = sinks(args.sink)
+    subscriber = MemorySubscriber(messages, rate=args.rate / args.workers)
+    worker = Worker(subscriber=subscriber, redis=Timed(redis, timings, "redis"), mongodb=FakeMongoDB(),
+                    ts=Timed(ts, timings, "timescale"), cassandra=Timed(cassandra, timings, "cassandra"),
+                    rolling_window=args.window, verbose=False)
+    worker.coalescer.max_batch = args.batch
+
+    flushes = defaultdict(list)
+    flush = worker.coalescer.flush
+
+    def timed_flush():
+        before = dict(timings)
+        flush()
+        for store in STORES:
+            flushes[store].append(timings[store] - before.get(store, 0.0))
+    worker.coalescer.flush = timed_flush
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    worker.run(membership=None, flush_interval=args.flush_interval)
+    elapsed = time.perf_counter() - start
+    end_usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (end_usage.ru_utime - usage.ru_utime) + (end_usage.ru_stime - usage.ru_stime)
+
+    return {
+        "worker": index,
+        "messages": len(messages),
+        "seconds": elapsed,
+        "msgs_per_sec": len(messages) / elapsed,
+        "cpu_seconds": cpu,
+        "cpu_percent": 100 * cpu / elapsed,
+        "max_rss_mb": end_usage.ru_maxrss / 1024,
+        "coalescing_ratio": worker.coalescer.ratio(),
+        "alerts": subscriber.published.get("alerts", 0),
+        "lags": subscriber.lags,
+        "flushes": {store: values for store, values in flushes.items()},
+    }
+
+
+def percentiles(values, points=(50, 95, 99)):
+    if not len(values):
+        return {f"p{p}": None for p in points}
+    return {f"p{p}": float(np.percentile(values, p)) for p in points}
+
+
+def summarize(args, results):
+    lags = np.concatenate([np.array(result.pop("lags")) for result in results])
+    flushes = defaultdict(list)
+    for result in results:
+        for store, values in result.pop("flushes").items():
+            flushes[store].extend(values)
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "config": vars(args),
+        "msgs_per_sec": sum(result["msgs_per_sec"] for result in results),
+        "lag_seconds": percentiles(lags),
+        "flush_seconds": {store: percentiles(np.array(flushes[store])) for store in STORES},
+        "workers": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--rate", type=float, default=0, help="target msgs/sec, 0 to go as fast as possible")
+    parser.add_argument("--sensors", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    parser.add_argument("--window", type=int, default=60)
+    parser.add_argument("--sink", choices=["fake", "local"], default="fake")
+    parser.add_argument("--output", default="bench_consumer.json")
+    args = parser.parse_args()
+
+    if args.workers == 1:
+        results = [run_worker(0, args)]
+    else:
+        with multiprocessing.Pool(args.workers) as pool:
+            results = pool.starmap(run_worker, [(index, args) for index in range(args.workers)])
+
+    summary = summarize(args, results)
+    with open(args.output, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"msgs/sec: {summary['msgs_per_sec']:.0f}")
+    print("lag (s): " + ", ".join(f"{k}={v:.4f}" for k, v in summary["lag_seconds"].items() if v is not None))
+    for store, values in summary["flush_seconds"].items():
+        print(f"flush {store} (s): " + ", ".join(f"{k}={v:.5f}" for k, v in values.items() if v is not None))
+    for result in summary["workers"]:
+        print(f"worker {result['worker']}: {result['msgs_per_sec']:.0f} msgs/sec, cpu {result['cpu_percent']:.0f}%, "
+              f"max rss {result['max_rss_mb']:.0f} MB, coalescing {result['coalescing_ratio']:.2f}")
+    print(f"saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+from datetime import datetime
+
+from shared.sensors import repository
+
+
+def parse_last_seen(last_seen):
+    # Sempre en UTC (les dates sense zona es consideren UTC), així es poden comparar entre elles
+    return repository.utc(datetime.fromisoformat(last_seen.replace("Z", "+00:00")))
+
+
+class Coalescer:
+    # Acumula les lectures d'una finestra de flush. Timescale i sensor_temperature_by_day
+    # reben totes les files, Redis i sensor_battery només la més nova de cada sensor
+    def __init__(self, redis, ts, cassandra, max_batch=500, stages=(), before_flush=None, verbose=True):
+        self.redis = redis
+        self.before_flush = before_flush
+        self.stages = list(stages)
+        self.verbose = verbose
+        self.ts = ts
+        self.cassandra = cassandra
+        self.max_batch = max_batch
+        self.readings = []
+        self.latest = {}
+        self.received = 0
+        self.written = 0
+
+    def add(self, sensor_id, data, sensor_type):
+        for stage in self.stages:
+            stage.add(sensor_id, data)
+        self.readings.append((sensor_id, data))
+        current = self.latest.get(sensor_id)
+        if current is None or parse_last_seen(data.last_seen) >= parse_last_seen(current[0].last_seen):
+            self.latest[sensor_id] = (data, sensor_type)
+
+    def forget(self, sensor_id):
+        # Treu les lectures pendents d'un sensor esborrat
+        self.readings = [(other, data) for other, data in self.readings if other != sensor_id]
+        self.latest.pop(sensor_id, None)
+
+    def full(self):
+        return len(self.readings) >= self.max_batch
+
+    def flush(self):
+        if self.before_flush is not None:
+            self.before_flush()
+        for stage in self.stages:
+            stage.flush()
+        if not self.readings:
+            return
+        repository.store_readings(ts=self.ts, cassandra=self.cassandra, readings=self.readings)
+        repository.store_latest(redis=self.redis, cassandra=self.cassandra, latest=self.latest)
+        self.received += len(self.readings)
+        self.written += len(self.latest)
+        if self.verbose:
+            print(f"Flushed {len(self.readings)} readings, {len(self.latest)} latest writes "
+                  f"(coalescing ratio {len(self.readings) / len(self.latest):.2f}, total {self.ratio():.2f})")
+        self.readings = []
+        self.latest = {}
+
+    def ratio(self):
+        # Lectures rebudes per cada escriptura als magatzems d'últim estat
+        return self.received / self.written if self.written else 1.0
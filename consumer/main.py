@@ -1,13 +1,77 @@
-import json
+import os
+import socket
+import time
 
 from shared.subscriber import Subscriber
+from shared.membership import Membership
+from shared.redis_client import RedisClient
+from shared.mongodb_client import MongoDBClient
+from shared.elasticsearch_client import ElasticsearchClient
+from shared.timescale import Timescale
+from shared.cassandra_client import CassandraClient
 
-subscriber = Subscriber()
+from shared.profiling import PROFILING, instrument_clients
+from shared.spool import claim_slot
 
+from consumer.worker import Worker
+from consumer.purge import Purger
 
-def callback(ch, method, properties, body):
-    data = json.loads(body)
-    print("Received data:", data)
+# Dins la xarxa de docker, cal posar-hi els noms dels serveis
+REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
+MONGODB_HOST = os.environ.get("MONGODB_HOST", "localhost")
+CASSANDRA_HOST = os.environ.get("CASSANDRA_HOST", "localhost")
+ELASTICSEARCH_HOST = os.environ.get("ELASTICSEARCH_HOST", "localhost")
+ROLLING_WINDOW = int(os.environ.get("ROLLING_WINDOW", 60))
+# Un checkpoint per worker: els consumidors d'un mateix host no es trepitgen el fitxer.
+# Sense WORKER_ID l'id és el host i un slot local, estable entre reinicis, així un
+# worker reinicat recupera el seu checkpoint
+ROLLING_CHECKPOINT_DIR = os.environ.get("ROLLING_CHECKPOINT_DIR", "rolling_checkpoints")
+WORKER_ID = os.environ.get("WORKER_ID")
 
 
-subscriber.subscribe(callback)
+def claim_worker_id():
+    if WORKER_ID:
+        return WORKER_ID, None
+    slot, lock = claim_slot(ROLLING_CHECKPOINT_DIR)
+    return f"{socket.gethostname()}-{slot}", lock
+
+
+MIGRATION_LOCK = "migrations:sensor_temperature:lock"
+
+
+def migrate_legacy_temperature(cassandra, redis, worker_id, lock_seconds=60):
+    # Tots els consumidors arrenquen alhora: només un fa la migració i la resta l'esperen
+    # (quan l'agafen la taula antiga ja no hi és i no fan res). El lock s'allarga a cada lot
+    while not redis.set(MIGRATION_LOCK, worker_id, ex=lock_seconds, nx=True):
+        time.sleep(1)
+    try:
+        return cassandra.migrate_legacy_temperature(on_batch=lambda: redis.set(MIGRATION_LOCK, worker_id, ex=lock_seconds))
+    finally:
+        redis.delete(MIGRATION_LOCK)
+
+
+def main():
+    if PROFILING:
+        instrument_clients()
+    worker_id, slot_lock = claim_worker_id() #el lock es manté mentre el procés viu
+    os.makedirs(ROLLING_CHECKPOINT_DIR, exist_ok=True)
+    membership = Membership(RedisClient(host=REDIS_HOST), worker_id=worker_id)
+    subscriber = Subscriber()
+    redis = RedisClient(host=REDIS_HOST)
+    mongodb = MongoDBClient(host=MONGODB_HOST)
+    ts = Timescale()
+    cassandra = CassandraClient(hosts=[CASSANDRA_HOST])
+    migrated = migrate_legacy_temperature(cassandra, redis, worker_id)
+    if migrated:
+        print(f"Copied {migrated} readings from sensor.sensor_temperature to sensor_temperature_by_day")
+    # Elasticsearch només es connecta quan arriba la primera purga
+    purger = Purger(redis=redis, mongodb=mongodb, ts=ts, cassandra=cassandra,
+                    es_connect=lambda: ElasticsearchClient(host=ELASTICSEARCH_HOST), publish=subscriber.publish_job)
+    worker = Worker(subscriber=subscriber, redis=redis, mongodb=mongodb, ts=ts, cassandra=cassandra,
+                    rolling_window=ROLLING_WINDOW, rolling_checkpoint=os.path.join(ROLLING_CHECKPOINT_DIR, f"{membership.worker_id}.npz"), purger=purger)
+    purger.forget = worker.forget
+    worker.run(membership)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import json
+from datetime import date, timedelta
+
+import bson
+
+from shared import purge
+from shared.cache import bump_version
+from shared.latest_table import LATEST_CHANNEL
+from shared.publisher import PURGE_QUEUE_NAME
+
+MAX_ATTEMPTS = 5
+
+
+class Purger:
+    # Executa les feines de purga de la cua PURGE_QUEUE_NAME. Cada missatge fa un
+    # sol lot (un pas, un chunk de Timescale o uns quants dies de Cassandra), desa el
+    # progrés a Redis i encua el següent, així la purga s'intercala amb la ingesta.
+    # El missatge porta el número de lot: si arriba repetit es descarta
+    def __init__(self, redis, mongodb, ts, cassandra, es_connect, publish, forget=None, days_per_batch=32, verbose=True):
+        self.redis = redis
+        self.mongodb = mongodb
+        self.ts = ts
+        self.cassandra = cassandra
+        self.es_connect = es_connect
+        self.es = None
+        self.publish = publish
+        self.forget = forget
+        self.days_per_batch = days_per_batch
+        self.verbose = verbose
+
+    def on_message(self, ch, method, properties, body):
+        message = json.loads(body)
+        job = purge.get_job(self.redis, message["job_id"])
+        if job is not None and job["status"] in ("queued", "running") and message["batch"] == job["batch"]:
+            self.run_batch(job)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def run_batch(self, job):
+        job["status"] = "running"
+        try:
+            done = getattr(self, "step_" + job["step"])(job)
+            job["error"] = None
+            job["attempts"] = 0
+        except Exception as e:
+            self.ts.conn.rollback()
+            done = False
+            job["error"] = str(e)
+            job["attempts"] += 1
+            if job["attempts"] >= MAX_ATTEMPTS:
+                job["status"] = "failed"
+                purge.save_job(self.redis, job)
+                return
+        if done:
+            next_step = purge.STEPS.index(job["step"]) + 1
+            job["cursor"] = None
+            if next_step == len(purge.STEPS):
+                job["status"] = "done"
+                job["step"] = None
+                purge.save_job(self.redis, job)
+                purge.unmark_deleted(self.redis, job["sensor_id"])
+                bump_version(self.redis) #els resultats analitics en cache encara inclouen el sensor
+                if self.verbose:
+                    print(f"Purged sensor {job['sensor_id']}: {job['deleted']} items, {job['reclaimed_bytes']} bytes")
+                return
+            job["step"] = purge.STEPS[next_step]
+        job["batch"] += 1
+        purge.save_job(self.redis, job)
+        self.publish(PURGE_QUEUE_NAME, json.dumps({"job_id": job["job_id"], "batch": job["batch"]}))
+
+    def record(self, job, store, deleted=0, reclaimed=0, done=True):
+        stats = job["stores"].setdefault(store, {"deleted": 0, "reclaimed_bytes": 0, "done": False})
+        stats["deleted"] += deleted
+        stats["reclaimed_bytes"] += reclaimed
+        stats["done"] = done
+        job["deleted"] += deleted
+        job["reclaimed_bytes"] += reclaimed
+        return done
+
+    def step_plan(self, job):
+        # Dies amb lectures a Cassandra i chunks de Timescale que toquen el sensor
+        sensor_id = job["sensor_id"]
+        if self.forget is not None:
+            self.forget(sensor_id)
+        self.ts.execute("SELECT min(last_seen), max(last_seen) FROM sensor_data WHERE id = %(id)s", {"id": sensor_id})
+        first, last = self.ts.cursor.fetchone()
+        chunks = []
+        days = []
+        if first is not None:
+            self.ts.execute(
+                """SELECT range_start, range_end FROM timescaledb_information.chunks
+                WHERE hypertable_name = 'sensor_data' AND range_end > %(first)s AND range_start <= %(last)s
+                ORDER BY range_start""", {"first": first, "last": last})
+            chunks = [[start.isoformat(), end.isoformat()] for start, end in self.ts.cursor.fetchall()]
+            # Cassandra rep les mateixes lectures que Timescale, i el TTL de cada fila compta
+            # des que s'escriu (no des de last_seen): cal el mateix rang de dies, sense retallar
+            days = [first.date().isoformat(), last.date().isoformat()]
+        self.ts.conn.commit()
+        job["plan"] = {"first": first.isoformat() if first else None, "last": last.isoformat() if last else None,
+                       "chunks": chunks, "days": days}
+        return True
+
+    def step_mongodb(self, job):
+        query = {"id": job["sensor_id"]}
+        reclaimed = sum(len(bson.encode(doc)) for doc in self.mongodb.find(query))
+        result = self.mongodb.delete(query)
+        return self.record(job, "mongodb", result.deleted_count, reclaimed)
+
+    def step_elasticsearch(self, job):
+        if self.es is None:
+            self.es = self.es_connect()
+        if not self.es.index_exists("sensors"):
+            return self.record(job, "elasticsearch")
+        result = self.es.delete_by_query("sensors", {"query": {"term": {"id": job["sensor_id"]}}})
+        return self.record(job, "elasticsearch", result["deleted"])
+
+    def step_redis(self, job):
+        return self.record(job, "redis", *self.delete_latest(job["sensor_id"]))
+
+    def delete_latest(self, sensor_id):
+        deleted = reclaimed = 0
+        for key in [str(sensor_id), f"rolling:{sensor_id}"]:
+            reclaimed += self.redis.memory_usage(key) or 0
+            deleted += self.redis.delete(key)
+        # Les taules d'últim estat en memòria compartida de l'API també buiden la posició
+        self.redis.publish(LATEST_CHANNEL, json.dumps({"id": sensor_id, "deleted": True}))
+        return deleted, reclaimed
+
+    def step_cassandra_days(self, job):
+        if not job["plan"]["days"]:
+            return self.record(job, "cassandra_days")
+        first_day, last_day = (date.fromisoformat(day) for day in job["plan"]["days"])
+        start = job["cursor"] or 0
+        days = [first_day + timedelta(days=i) for i in range(start, min(start + self.days_per_batch, (last_day - first_day).days + 1))]
+        deleted = self.delete_days(job["sensor_id"], days)
+        job["cursor"] = start + len(days)
+        done = first_day + timedelta(days=job["cursor"]) > last_day
+        return self.record(job, "cassandra_days", deleted, done=done)
+
+    def delete_days(self, sensor_id, days):
+        # Esborra particions (id, day) senceres: una làpida per partició. Abans es mira quines
+        # tenen files, per no escriure làpides (ni comptar-les) als dies sense lectures
+        self.cassandra.create_tables()
+        select = self.cassandra.prepare("SELECT last_seen FROM sensor.sensor_temperature_by_day WHERE id = ? AND day = ? LIMIT 1")
+        partitions = [(sensor_id, day) for day in days]
+        filled = []
+        for partition, (success, result) in zip(partitions, self.cassandra.execute_concurrent(select, partitions)):
+            if not success:
+                raise result
+            if result.one() is not None:
+                filled.append(partition)
+        delete = self.cassandra.prepare("DELETE FROM sensor.sensor_temperature_by_day WHERE id = ? AND day = ?")
+        for success, result in self.cassandra.execute_concurrent(delete, filled):
+            if not success:
+                raise result
+        return len(filled)
+
+    def step_cassandra(self, job):
+        return self.record(job, "cassandra", self.delete_cassandra(job["sensor_id"], job["sensor_type"]))
+
+    def delete_cassandra(self, sensor_id, sensor_type):
+        self.cassandra.create_tables()
+        deleted = 0
+        if sensor_type is not None:
+            self.cassandra.execute("DELETE FROM sensor.sensor_type WHERE type = %s AND id = %s", (sensor_type, sensor_id))
+            deleted += 1
+        self.cassandra.execute("DELETE FROM sensor.sensor_battery WHERE id = %s", (sensor_id,))
+        return deleted + 1
+
+    def step_timescale(self, job):
+        # Un chunk per lot: el rang de temps fa que només s'obri aquell chunk i la transacció sigui curta
+        chunks = job["plan"]["chunks"]
+        index = job["cursor"] or 0
+        conditions = ["id = %(id)s"]
+        params = {"id": job["sensor_id"]}
+        if index < len(chunks):
+            conditions += ["last_seen >= %(start)s", "last_seen < %(end)s"]
+            params["start"], params["end"] = chunks[index]
+        deleted, reclaimed = self.delete_rows(conditions, params)
+        job["cursor"] = index + 1
+        # Després de l'últim chunk, un lot final sense rang recull les files escrites mentrestant
+        return self.record(job, "timescale", deleted, reclaimed, done=index >= len(chunks))
+
+    def delete_rows(self, conditions, params):
+        self.ts.execute(
+            f"""WITH deleted AS (DELETE FROM sensor_data WHERE {' AND '.join(conditions)} RETURNING pg_column_size(sensor_data.*) AS size)
+            SELECT count(*), coalesce(sum(size), 0) FROM deleted""", params)
+        deleted, reclaimed = self.ts.cursor.fetchone()
+        self.ts.conn.commit()
+        return deleted, int(reclaimed)
+
+    def step_sweep(self, job):
+        # Un flush que ja estava en marxa quan es va marcar el sensor pot haver tornat a escriure
+        # l'últim estat (Redis, sensor_battery, sensor_type) o lectures noves després dels passos
+        # anteriors. Els workers descarten el sensor a cada flush, així que una última passada
+        # al final de la purga ho recull tot
+        sensor_id = job["sensor_id"]
+        deleted, reclaimed = self.delete_latest(sensor_id)
+        deleted += self.delete_cassandra(sensor_id, job["sensor_type"])
+        self.ts.execute("SELECT min(last_seen), max(last_seen) FROM sensor_data WHERE id = %(id)s", {"id": sensor_id})
+        first, last = self.ts.cursor.fetchone()
+        if first is not None:
+            deleted += self.delete_days(sensor_id, [first.date() + timedelta(days=i) for i in range((last.date() - first.date()).days + 1)])
+            rows, size = self.delete_rows(["id = %(id)s"], {"id": sensor_id})
+            deleted += rows
+            reclaimed += size
+        self.ts.conn.commit()
+        return self.record(job, "sweep", deleted, reclaimed)
@@ -0,0 +1,150 @@
+import json
+import operator
+import os
+import time
+import warnings
+
+import numpy as np
+
+from consumer.coalescer import parse_last_seen
+
+FIELDS = ["temperature", "humidity", "battery_level"]
+
+# (nom, camp, estadística, operador, llindar). La taxa de canvi és per hora
+ALERT_RULES = [
+    ("overheating", "temperature", "max", ">", 40.0),
+    ("battery_draining", "battery_level", "rate", "<", -0.05),
+    ("low_battery", "battery_level", "mean", "<", 0.2),
+]
+
+OPERATORS = {">": operator.gt, "<": operator.lt}
+
+
+class RollingStats:
+    # Finestra mòbil de les últimes `window` lectures de cada sensor en un buffer
+    # circular NumPy de mida fixa (temps + un camp per columna). A cada lectura
+    # recalcula mitjana, mínim, màxim i taxa de canvi, i avisa quan es creua un llindar
+    def __init__(self, redis, emit, window=60, rules=ALERT_RULES, checkpoint_path=None, checkpoint_interval=30):
+        self.redis = redis
+        self.emit = emit
+        self.window = window
+        self.rules = rules
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.slots = {}
+        self.buffers = np.full((16, window, len(FIELDS) + 1), np.nan)
+        self.positions = np.zeros(16, dtype=np.int64)
+        self.counts = np.zeros(16, dtype=np.int64)
+        self.alerts = set()
+        self.stats = {}
+        self.dirty = set()
+        self.last_checkpoint = time.monotonic()
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            self.restore()
+
+    def _slot(self, sensor_id):
+        if sensor_id not in self.slots:
+            if len(self.slots) == len(self.buffers):
+                grow = len(self.buffers)
+                self.buffers = np.concatenate([self.buffers, np.full((grow, self.window, len(FIELDS) + 1), np.nan)])
+                self.positions = np.concatenate([self.positions, np.zeros(grow, dtype=np.int64)])
+                self.counts = np.concatenate([self.counts, np.zeros(grow, dtype=np.int64)])
+            self.slots[sensor_id] = len(self.slots)
+        return self.slots[sensor_id]
+
+    def add(self, sensor_id, data):
+        slot = self._slot(sensor_id)
+        row = [parse_last_seen(data.last_seen).timestamp()] + [getattr(data, field) for field in FIELDS]
+        self.buffers[slot, self.positions[slot]] = np.array(row, dtype=np.float64)
+        self.positions[slot] = (self.positions[slot] + 1) % self.window
+        self.counts[slot] = min(self.counts[slot] + 1, self.window)
+        self.stats[sensor_id] = self.compute(slot)
+        self.dirty.add(sensor_id)
+        self.check(sensor_id, data.last_seen)
+
+    def forget(self, sensor_id):
+        # Buida la finestra d'un sensor esborrat; la posició queda lliure però no es reaprofita
+        slot = self.slots.get(sensor_id)
+        if slot is not None:
+            self.buffers[slot] = np.nan
+            self.positions[slot] = 0
+            self.counts[slot] = 0
+        self.stats.pop(sensor_id, None)
+        self.dirty.discard(sensor_id)
+        self.alerts = {key for key in self.alerts if key[0] != sensor_id}
+
+    def compute(self, slot):
+        n = self.counts[slot]
+        # Lectures en ordre cronològic
+        window = np.roll(self.buffers[slot], -self.positions[slot], axis=0)[self.window - n:]
+        times, values = window[:, 0], window[:, 1:]
+        valid = ~np.isnan(values)
+        has = valid.any(axis=0)
+        first = np.argmax(valid, axis=0)
+        last = n - 1 - np.argmax(valid[::-1], axis=0)
+        columns = np.arange(len(FIELDS))
+        elapsed = (times[last] - times[first]) / 3600
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            mean = np.nanmean(values, axis=0)
+            minimum = np.nanmin(values, axis=0)
+            maximum = np.nanmax(values, axis=0)
+            rate = np.where(has & (elapsed > 0), (values[last, columns] - values[first, columns]) / elapsed, np.nan)
+        return {
+            field: {
+                "mean": mean[i], "min": minimum[i], "max": maximum[i], "rate": rate[i],
+            }
+            for i, field in enumerate(FIELDS)
+        }
+
+    def check(self, sensor_id, last_seen):
+        for name, field, stat, op, threshold in self.rules:
+            value = self.stats[sensor_id][field][stat]
+            crossed = not np.isnan(value) and OPERATORS[op](value, threshold)
+            key = (sensor_id, name)
+            if crossed == (key in self.alerts):
+                continue
+            if crossed:
+                self.alerts.add(key)
+            else:
+                self.alerts.discard(key)
+            self.emit({"sensor_id": sensor_id, "alert": name, "state": "raised" if crossed else "cleared",
+                       "field": field, "stat": stat, "value": float(value) if not np.isnan(value) else None,
+                       "threshold": threshold, "last_seen": last_seen})
+
+    def flush(self):
+        # Escriu a Redis només les estadístiques dels sensors que han canviat
+        for sensor_id in self.dirty:
+            stats = {field: {stat: (None if np.isnan(value) else float(value)) for stat, value in values.items()}
+                     for field, values in self.stats[sensor_id].items()}
+            self.redis.set(f"rolling:{sensor_id}", json.dumps(stats))
+        self.dirty = set()
+        if self.checkpoint_path and time.monotonic() - self.last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        n = len(self.slots)
+        ids = np.array(sorted(self.slots, key=self.slots.get), dtype=np.int64)
+        alerts = np.array([(sensor_id, name) for sensor_id, name in self.alerts], dtype=object).reshape(-1, 2)
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, ids=ids, buffers=self.buffers[:n], positions=self.positions[:n], counts=self.counts[:n],
+                     alert_ids=alerts[:, 0].astype(np.int64), alert_names=alerts[:, 1].astype(str))
+        os.replace(tmp, self.checkpoint_path)
+        self.last_checkpoint = time.monotonic()
+
+    def restore(self):
+        state = np.load(self.checkpoint_path)
+        if state["buffers"].shape[1:] != self.buffers.shape[1:]:
+            # La mida de finestra ha canviat, comencem de zero
+            return
+        for sensor_id in state["ids"]:
+            self._slot(int(sensor_id))
+        n = len(state["ids"])
+        self.buffers[:n] = state["buffers"]
+        self.positions[:n] = state["positions"]
+        self.counts[:n] = state["counts"]
+        self.alerts = {(int(sensor_id), str(name)) for sensor_id, name in zip(state["alert_ids"], state["alert_names"])}
+        for sensor_id, slot in self.slots.items():
+            if self.counts[slot]:
+                self.stats[sensor_id] = self.compute(slot)
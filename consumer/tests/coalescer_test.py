@@ -0,0 +1,79 @@
+import json
+from types import SimpleNamespace
+
+from shared.sensors import schemas
+from consumer.bench import FakeRedis, FakeTimescale, FakeCassandra, FakeMongoDB
+from consumer.coalescer import Coalescer, parse_last_seen
+from consumer.worker import Worker
+
+
+def reading(last_seen, temperature=20.0):
+    return schemas.SensorData(temperature=temperature, humidity=50.0, battery_level=0.5, velocity=None, last_seen=last_seen)
+
+def test_parse_last_seen_naive_is_utc():
+    assert parse_last_seen("2020-01-01T00:00:00") == parse_last_seen("2020-01-01T00:00:00Z")
+    assert parse_last_seen("2020-01-01T01:00:00+01:00") == parse_last_seen("2020-01-01T00:00:00.000Z")
+
+def test_coalescer_keeps_newest_mixing_naive_and_aware():
+    coalescer = Coalescer(redis=FakeRedis(), ts=FakeTimescale(), cassandra=FakeCassandra(), verbose=False)
+    coalescer.add(1, reading("2020-01-01T00:00:01"), "Temperatura")
+    coalescer.add(1, reading("2020-01-01T00:00:00.000Z"), "Temperatura")
+    coalescer.add(1, reading("2020-01-01T00:00:02+00:00", temperature=30.0), "Temperatura")
+    assert len(coalescer.readings) == 3
+    assert coalescer.latest[1][0].temperature == 30.0
+
+def test_coalescer_flush_writes_latest_once_per_sensor():
+    redis, ts = FakeRedis(), FakeTimescale()
+    coalescer = Coalescer(redis=redis, ts=ts, cassandra=FakeCassandra(), max_batch=3, verbose=False)
+    for second in range(3):
+        coalescer.add(1, reading(f"2020-01-01T00:00:0{second}Z", temperature=float(second)), "Temperatura")
+    coalescer.add(2, reading("2020-01-01T00:00:00Z"), "Temperatura")
+    assert coalescer.full()
+    coalescer.flush()
+    assert ts.rows == 4
+    assert json.loads(redis.get(1))["temperature"] == 2.0
+    assert coalescer.ratio() == 2.0
+    assert coalescer.readings == [] and coalescer.latest == {}
+
+def test_coalescer_forget():
+    coalescer = Coalescer(redis=FakeRedis(), ts=FakeTimescale(), cassandra=FakeCassandra(), verbose=False)
+    coalescer.add(1, reading("2020-01-01T00:00:00Z"), "Temperatura")
+    coalescer.add(2, reading("2020-01-01T00:00:00Z"), "Temperatura")
+    coalescer.forget(1)
+    assert [sensor_id for sensor_id, _ in coalescer.readings] == [2]
+    assert list(coalescer.latest) == [2]
+
+
+class NullSubscriber:
+    def publish(self, queue, body):
+        pass
+
+def test_worker_rejects_unparseable_messages():
+    worker = Worker(subscriber=NullSubscriber(), redis=FakeRedis(), mongodb=FakeMongoDB(), ts=FakeTimescale(), cassandra=FakeCassandra(), verbose=False)
+    properties = SimpleNamespace(headers={"sensor_id": 1})
+    worker.callback(None, None, properties, b"not json")
+    worker.callback(None, None, properties, json.dumps({"battery_level": 0.5, "last_seen": "yesterday"}).encode())
+    worker.callback(None, None, properties, json.dumps({"battery_level": 0.5, "last_seen": "2020-01-01T00:00:00Z", "temperature": 1.0}).encode())
+    assert worker.rejected == 2
+    assert len(worker.coalescer.readings) == 1
+
+class TombstoneRedis(FakeRedis):
+    def __init__(self):
+        super().__init__()
+        self.members = set()
+
+    def smembers(self, key):
+        return self.members
+
+def test_worker_drops_buffered_readings_of_deleted_sensors_at_flush():
+    redis = TombstoneRedis()
+    worker = Worker(subscriber=NullSubscriber(), redis=redis, mongodb=FakeMongoDB(), ts=FakeTimescale(), cassandra=FakeCassandra(), verbose=False)
+    for sensor_id in (1, 2):
+        properties = SimpleNamespace(headers={"sensor_id": sensor_id})
+        worker.callback(None, None, properties, json.dumps({"battery_level": 0.5, "last_seen": "2020-01-01T00:00:00Z", "temperature": 1.0}).encode())
+    # Esborrat des d'un altre worker abans que passi deleted_refresh
+    redis.members = {b"1"}
+    worker.coalescer.flush()
+    assert redis.get(1) is None
+    assert redis.get(2) is not None
+    assert worker.is_deleted(1)
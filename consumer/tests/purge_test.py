@@ -0,0 +1,121 @@
+from datetime import date, datetime, timezone
+from types import SimpleNamespace
+
+from shared import purge
+from consumer.bench import FakeRedis
+from consumer.purge import Purger
+
+
+class PlanTimescale:
+    def __init__(self, first, last):
+        self.results = [[(first, last)], [(first, last)]]
+        self.cursor = SimpleNamespace(fetchone=lambda: self.results[0][0], fetchall=lambda: self.results[1])
+        self.conn = SimpleNamespace(commit=lambda: None, rollback=lambda: None)
+
+    def execute(self, query, params=None):
+        pass
+
+
+class DaysCassandra:
+    # Particions (id, day) amb files; cada DELETE en treu una
+    def __init__(self, partitions):
+        self.partitions = set(partitions)
+        self.deleted = []
+
+    def create_tables(self):
+        pass
+
+    def prepare(self, query):
+        return query
+
+    def execute_concurrent(self, statement, params):
+        if statement.startswith("SELECT"):
+            return [(True, SimpleNamespace(one=lambda p=p: p if p in self.partitions else None)) for p in params]
+        for partition in params:
+            self.partitions.discard(partition)
+            self.deleted.append(partition)
+        return [(True, None) for _ in params]
+
+
+def purger(ts=None, cassandra=None, days_per_batch=32):
+    return Purger(redis=FakeRedis(), mongodb=None, ts=ts, cassandra=cassandra, es_connect=None,
+                  publish=lambda queue, body: None, days_per_batch=days_per_batch, verbose=False)
+
+def test_plan_keeps_timescale_day_range():
+    # Lectures de fa anys: el TTL compta des de l'escriptura, les particions encara hi són
+    first = datetime(2020, 1, 1, 12, tzinfo=timezone.utc)
+    last = datetime(2020, 1, 3, 8, tzinfo=timezone.utc)
+    job = purge.new_job(1, "Temperatura")
+    purger(ts=PlanTimescale(first, last)).step_plan(job)
+    assert job["plan"]["days"] == ["2020-01-01", "2020-01-03"]
+
+def test_cassandra_days_counts_only_filled_partitions():
+    cassandra = DaysCassandra({(1, date(2020, 1, 1)), (1, date(2020, 1, 3)), (2, date(2020, 1, 2))})
+    job = purge.new_job(1, "Temperatura")
+    job["plan"] = {"days": ["2020-01-01", "2020-01-03"]}
+    worker = purger(cassandra=cassandra, days_per_batch=2)
+    assert not worker.step_cassandra_days(job)
+    assert worker.step_cassandra_days(job)
+    assert sorted(cassandra.deleted) == [(1, date(2020, 1, 1)), (1, date(2020, 1, 3))]
+    assert cassandra.partitions == {(2, date(2020, 1, 2))}
+    assert job["stores"]["cassandra_days"]["deleted"] == 2
+
+
+class SweepTimescale(PlanTimescale):
+    def __init__(self, first, last):
+        super().__init__(first, last)
+        self.results = [[(first, last)], []]
+        self.queries = []
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+        if query.lstrip().startswith("WITH deleted"):
+            self.results[0] = [(3, 120)]
+
+
+class SweepRedis(FakeRedis):
+    def memory_usage(self, key):
+        return 10 if key in self.data else None
+
+
+class LatestCassandra(DaysCassandra):
+    def __init__(self, partitions):
+        super().__init__(partitions)
+        self.statements = []
+
+    def execute(self, query, params=None):
+        self.statements.append((query, params))
+
+def test_sweep_removes_state_written_after_the_purge_steps():
+    # Un flush en marxa ha tornat a escriure l'últim estat i lectures noves
+    moment = datetime(2024, 5, 1, 10, tzinfo=timezone.utc)
+    redis = SweepRedis()
+    redis.set(7, "{}")
+    cassandra = LatestCassandra({(7, date(2024, 5, 1))})
+    ts = SweepTimescale(moment, moment)
+    worker = Purger(redis=redis, mongodb=None, ts=ts, cassandra=cassandra, es_connect=None,
+                    publish=lambda queue, body: None, verbose=False)
+    job = purge.new_job(7, "Temperatura")
+    assert worker.step_sweep(job)
+    assert redis.get(7) is None
+    assert cassandra.partitions == set()
+    assert [params for _, params in cassandra.statements] == [("Temperatura", 7), (7,)]
+    assert job["stores"]["sweep"] == {"deleted": 1 + 2 + 1 + 3, "reclaimed_bytes": 10 + 120, "done": True}
+    assert purge.STEPS[-1] == "sweep"
+
+def test_done_job_drops_its_tombstone():
+    class TombstoneRedis(SweepRedis):
+        members = {7, 8}
+
+        def srem(self, key, sensor_id):
+            self.members.discard(sensor_id)
+
+    moment = datetime(2024, 5, 1, 10, tzinfo=timezone.utc)
+    redis = TombstoneRedis()
+    worker = Purger(redis=redis, mongodb=None, ts=SweepTimescale(moment, moment), cassandra=LatestCassandra(set()), es_connect=None,
+                    publish=lambda queue, body: None, verbose=False)
+    job = purge.new_job(7, "Temperatura")
+    job["step"] = "sweep"
+    worker.run_batch(job)
+    assert job["status"] == "done"
+    assert redis.members == {8}
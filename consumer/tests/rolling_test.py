@@ -0,0 +1,51 @@
+import json
+
+from shared.sensors import schemas
+from consumer.bench import FakeRedis
+from consumer.rolling import RollingStats
+
+
+def reading(minute, temperature=20.0, battery_level=0.5):
+    return schemas.SensorData(temperature=temperature, humidity=50.0, battery_level=battery_level, velocity=None,
+                              last_seen=f"2020-01-01T00:{minute:02d}:00Z")
+
+def test_rolling_window_stats():
+    redis = FakeRedis()
+    stats = RollingStats(redis=redis, emit=lambda event: None, window=3)
+    for minute, temperature in enumerate([10.0, 20.0, 30.0, 40.0]):
+        stats.add(1, reading(minute, temperature))
+    stats.flush()
+    temperature = json.loads(redis.get("rolling:1"))["temperature"]
+    assert temperature["mean"] == 30.0
+    assert temperature["min"] == 20.0
+    assert temperature["max"] == 40.0
+    assert temperature["rate"] == 20.0 / (2 / 60)
+
+def test_rolling_alert_raised_and_cleared():
+    events = []
+    stats = RollingStats(redis=FakeRedis(), emit=events.append, window=2)
+    stats.add(1, reading(0, temperature=45.0))
+    stats.add(1, reading(1, temperature=20.0))
+    stats.add(1, reading(2, temperature=20.0))
+    overheating = [(event["alert"], event["state"]) for event in events if event["alert"] == "overheating"]
+    assert overheating == [("overheating", "raised"), ("overheating", "cleared")]
+
+def test_rolling_checkpoint_restore(tmp_path):
+    path = str(tmp_path / "worker.npz")
+    stats = RollingStats(redis=FakeRedis(), emit=lambda event: None, window=4, checkpoint_path=path)
+    for minute in range(6):
+        stats.add(minute % 2 + 1, reading(minute, temperature=41.0 + minute))
+    stats.checkpoint()
+    restored = RollingStats(redis=FakeRedis(), emit=lambda event: None, window=4, checkpoint_path=path)
+    assert restored.slots == stats.slots
+    assert restored.alerts == stats.alerts
+    for sensor_id in (1, 2):
+        assert restored.stats[sensor_id]["temperature"]["max"] == stats.stats[sensor_id]["temperature"]["max"]
+    # Amb una mida de finestra diferent el checkpoint s'ignora
+    assert RollingStats(redis=FakeRedis(), emit=lambda event: None, window=8, checkpoint_path=path).stats == {}
+
+def test_rolling_forget():
+    stats = RollingStats(redis=FakeRedis(), emit=lambda event: None, window=2)
+    stats.add(1, reading(0, temperature=45.0))
+    stats.forget(1)
+    assert 1 not in stats.stats and not stats.alerts and not stats.dirty
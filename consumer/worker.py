@@ -0,0 +1,89 @@
+import json
+import time
+
+from shared.publisher import ALERTS_QUEUE_NAME, PURGE_QUEUE_NAME
+from shared.purge import deleted_sensors
+from shared.sensors import schemas
+from shared.profiling import PROFILING, ReportRing, profiled
+
+from consumer.coalescer import Coalescer, parse_last_seen
+from consumer.rolling import RollingStats
+
+
+class Worker:
+    # Tot el que fa un consumidor amb cada missatge, independent d'on venen
+    # els missatges (RabbitMQ o una cua en memòria) i d'on s'escriuen
+    def __init__(self, subscriber, redis, mongodb, ts, cassandra, rolling_window=60, rolling_checkpoint=None, verbose=True, purger=None, deleted_refresh=5):
+        self.subscriber = subscriber
+        self.redis = redis
+        self.mongodb = mongodb
+        self.verbose = verbose
+        self.rolling = RollingStats(redis=redis, emit=lambda event: subscriber.publish(ALERTS_QUEUE_NAME, json.dumps(event)),
+                                    window=rolling_window, checkpoint_path=rolling_checkpoint)
+        # Abans de cada flush es tornen a llegir els sensors esborrats: les lectures que
+        # s'havien acumulat d'un sensor esborrat no tornen a crear-ne l'últim estat
+        self.coalescer = Coalescer(redis=redis, ts=ts, cassandra=cassandra, stages=[self.rolling],
+                                   before_flush=self.refresh_deleted, verbose=verbose)
+        self.sensor_types = {}
+        self.purger = purger
+        self.deleted = set()
+        self.deleted_refresh = deleted_refresh
+        self.deleted_checked = 0
+        self.rejected = 0
+        if PROFILING:
+            # Mateix mostreig que l'API, per missatge i per flush
+            ring = ReportRing()
+            self.callback = profiled(self.callback, "consumer callback", ring)
+            self.coalescer.flush = profiled(self.coalescer.flush, "consumer flush", ring)
+
+    def get_sensor_type(self, sensor_id):
+        # El tipus d'un sensor no canvia, només el consultem a MongoDB la primera vegada
+        if sensor_id not in self.sensor_types:
+            mongo_sensor = self.mongodb.get({"id": sensor_id})
+            if mongo_sensor is None:
+                return None
+            self.sensor_types[sensor_id] = mongo_sensor["type"]
+        return self.sensor_types[sensor_id]
+
+    def forget(self, sensor_id):
+        self.deleted.add(sensor_id)
+        self.sensor_types.pop(sensor_id, None)
+        self.coalescer.forget(sensor_id)
+        self.rolling.forget(sensor_id)
+
+    def refresh_deleted(self):
+        for deleted_id in deleted_sensors(self.redis) - self.deleted:
+            self.forget(deleted_id)
+        self.deleted_checked = time.monotonic()
+
+    def is_deleted(self, sensor_id):
+        # Els sensors esborrats des d'altres workers es llegeixen de Redis cada deleted_refresh segons
+        if time.monotonic() - self.deleted_checked >= self.deleted_refresh:
+            self.refresh_deleted()
+        return sensor_id in self.deleted
+
+    def callback(self, ch, method, properties, body):
+        sensor_id = properties.headers["sensor_id"]
+        if self.is_deleted(sensor_id):
+            return
+        try:
+            data = schemas.SensorData.parse_raw(body)
+            parse_last_seen(data.last_seen)
+        except (ValueError, TypeError) as e:
+            # Un missatge que no es pot llegir no s'arreglarà reenviant-lo: el descartem (se'n fa l'ack)
+            # en lloc de fer caure el consumidor i bloquejar la partició
+            self.rejected += 1
+            print("Rejected message:", sensor_id, body[:200], e)
+            return
+        if self.verbose:
+            print("Received data:", sensor_id, data)
+        sensor_type = self.get_sensor_type(sensor_id)
+        if sensor_type is None:
+            # Sensor esborrat o inexistent: descartem la lectura
+            return
+        self.coalescer.add(sensor_id, data, sensor_type)
+
+    def run(self, membership, **kwargs):
+        if self.purger is not None:
+            self.subscriber.consume(PURGE_QUEUE_NAME, self.purger.on_message)
+        self.subscriber.subscribe_partitions(self.callback, membership, batch=self.coalescer, **kwargs)
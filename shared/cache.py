@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+import time
+
+from shared.redis_client import RedisClient
+
+VERSION_KEY = "ingest:version"
+CACHE_PREFIX = "cache:"
+
+# Segons que una entrada es pot continuar servint després que arribin dades noves
+STALE_SECONDS = float(os.environ.get("ANALYTICS_CACHE_STALE_SECONDS", 5))
+
+
+def bump_version(redis: RedisClient):
+    # El camí d'escriptura l'incrementa cada vegada que entren lectures noves
+    return redis.incr(VERSION_KEY)
+
+
+def current_version(redis: RedisClient) -> int:
+    version = redis.get(VERSION_KEY)
+    return int(version) if version is not None else 0
+
+
+class ResultCache:
+    # Cache de resultats a Redis indexada per la versió d'ingesta. Només una
+    # petició recalcula una entrada caducada; la resta serveixen l'anterior o l'esperen
+    def __init__(self, redis: RedisClient, stale_seconds=STALE_SECONDS, lock_seconds=30, wait_seconds=5):
+        self.redis = redis
+        self.stale_seconds = stale_seconds
+        self.lock_seconds = lock_seconds
+        self.wait_seconds = wait_seconds
+
+    def _load(self, name):
+        raw = self.redis.get(CACHE_PREFIX + name)
+        return json.loads(raw) if raw is not None else None
+
+    def _fresh(self, entry, version):
+        return entry is not None and (entry["version"] == version or time.time() - entry["computed_at"] <= self.stale_seconds)
+
+    def get(self, name, compute):
+        # Retorna un diccionari amb el cos JSON ja serialitzat i el seu ETag
+        version = current_version(self.redis)
+        entry = self._load(name)
+        if self._fresh(entry, version):
+            return entry
+
+        lock = CACHE_PREFIX + name + ":lock"
+        if self.redis.set(lock, 1, ex=self.lock_seconds, nx=True):
+            try:
+                return self._store(name, version, compute())
+            finally:
+                self.redis.delete(lock)
+
+        # Una altra petició ja l'està recalculant
+        if entry is not None:
+            return entry
+        deadline = time.monotonic() + self.wait_seconds
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = self._load(name)
+            if entry is not None:
+                return entry
+        return self._store(name, version, compute())
+
+    def _store(self, name, version, body):
+        entry = {
+            "version": version,
+            "computed_at": time.time(),
+            "etag": '"' + hashlib.md5(body.encode()).hexdigest() + '"',
+            "body": body,
+        }
+        self.redis.set(CACHE_PREFIX + name, json.dumps(entry))
+        return entry
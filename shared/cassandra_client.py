@@ -1,4 +1,10 @@
+import os
+
 from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent_with_args
+
+# Segons que es guarden les lectures de temperatura (per defecte 90 dies)
+TEMPERATURE_TTL = int(os.environ.get("CASSANDRA_TEMPERATURE_TTL", 90 * 24 * 3600))
 
 class CassandraClient:
     def __init__(self, hosts):
@@ -11,8 +17,15 @@ class CassandraClient:
     def close(self):
         self.cluster.shutdown()
 
-    def execute(self, query):
-        return self.get_session().execute(query)
+    def execute(self, query, params=None):
+        return self.get_session().execute(query, params)
+
+    def prepare(self, query):
+        return self.get_session().prepare(query)
+
+    def execute_concurrent(self, statement, params, concurrency=32):
+        # Executa la mateixa sentència preparada amb cada tupla de paràmetres en paral·lel
+        return execute_concurrent_with_args(self.get_session(), statement, params, concurrency=concurrency)
     
     def create_tables(self):
         self.execute(
@@ -23,12 +36,23 @@ class CassandraClient:
             """
         )
 
+        # Una partició per sensor i dia: les particions no creixen sense límit i
+        # TWCS compacta cada dia per separat i descarta finestres senceres quan caduquen
         self.execute(
-            """CREATE TABLE IF NOT EXISTS sensor.sensor_temperature(
+            f"""CREATE TABLE IF NOT EXISTS sensor.sensor_temperature_by_day(
                 id INT,
+                day DATE,
                 last_seen TIMESTAMP,
                 temperature FLOAT,
-                PRIMARY KEY (id, last_seen))
+                PRIMARY KEY ((id, day), last_seen))
+                WITH CLUSTERING ORDER BY (last_seen ASC)
+                AND compaction = {{
+                    'class': 'TimeWindowCompactionStrategy',
+                    'compaction_window_unit': 'DAYS',
+                    'compaction_window_size': 1
+                }}
+                AND default_time_to_live = {TEMPERATURE_TTL}
+                AND gc_grace_seconds = 3600
             """
         )
         self.execute(
@@ -44,3 +68,37 @@ class CassandraClient:
                 battery_level decimal)
                 """
         )
+
+    def migrate_legacy_temperature(self, batch=1000, on_batch=None):
+        # Migració única de l'antiga sensor.sensor_temperature ((id), last_seen) a
+        # sensor_temperature_by_day i després s'esborra la taula. Les files copiades reben
+        # el TTL de la taula nova des del moment de la còpia, com qualsevol escriptura.
+        # Si la taula ja no existeix no fa res, es pot cridar a cada arrencada (però no des de
+        # dos processos alhora: un podria esborrar la taula mentre l'altre encara la llegeix).
+        # on_batch es crida després de cada lot, p. ex. per allargar un lock
+        legacy = self.execute(
+            "SELECT table_name FROM system_schema.tables WHERE keyspace_name = 'sensor' AND table_name = 'sensor_temperature'")
+        if not list(legacy):
+            return 0
+        self.create_tables()
+        statement = self.prepare(
+            "INSERT INTO sensor.sensor_temperature_by_day (id, day, last_seen, temperature) VALUES (?, ?, ?, ?)")
+        copied = 0
+        params = []
+        for row in self.execute("SELECT id, last_seen, temperature FROM sensor.sensor_temperature"):
+            # El driver retorna els TIMESTAMP en UTC sense zona
+            params.append((row.id, row.last_seen.date(), row.last_seen, row.temperature))
+            if len(params) == batch:
+                copied += self._insert_all(statement, params)
+                params = []
+                if on_batch is not None:
+                    on_batch()
+        copied += self._insert_all(statement, params)
+        self.execute("DROP TABLE IF EXISTS sensor.sensor_temperature")
+        return copied
+
+    def _insert_all(self, statement, params):
+        for success, result in self.execute_concurrent(statement, params):
+            if not success:
+                raise result
+        return len(params)
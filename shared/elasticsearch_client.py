@@ -40,6 +40,9 @@ class ElasticsearchClient:
     
     def index_exists(self,es_index_name):
         return self.client.indices.exists(index=es_index_name)
+
+    def delete_by_query(self, index_name, query):
+        return self.client.delete_by_query(index=index_name, body=query, refresh=True, conflicts="proceed")
     
 
     
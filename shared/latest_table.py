@@ -0,0 +1,140 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from shared.redis_client import RedisClient
+
+LATEST_CHANNEL = "latest"
+
+RECORD = np.dtype([
+    ("seq", "<u8"),
+    ("last_seen", "<i8"),
+    ("temperature", "<f8"),
+    ("humidity", "<f8"),
+    ("velocity", "<f8"),
+    ("battery_level", "<f8"),
+])
+FIELDS = ["temperature", "humidity", "velocity", "battery_level"]
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# last_seen d'una posició buidada per un sensor esborrat
+EMPTY = np.iinfo(np.int64).min
+
+
+def to_micros(last_seen: str) -> int:
+    moment = datetime.fromisoformat(last_seen.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def format_last_seen(micros: int) -> str:
+    # Format únic de last_seen per a la taula i per a Redis: ISO en UTC amb "Z", mil·lisegons si n'hi ha prou
+    moment = EPOCH + timedelta(microseconds=int(micros))
+    timespec = "milliseconds" if micros % 1000 == 0 else "microseconds"
+    return moment.replace(tzinfo=None).isoformat(timespec=timespec) + "Z"
+
+
+class LatestTable:
+    # Taula d'últimes lectures en memòria compartida (un fitxer mapejat, normalment
+    # a /dev/shm) que comparteixen tots els workers d'un mateix host. La posició és
+    # l'id del sensor. Un sol escriptor; els lectors fan servir un seqlock: si el
+    # comptador és senar o ha canviat durant la lectura, tornen a llegir
+    def __init__(self, path, capacity=100_000):
+        self.path = path
+        self.capacity = capacity
+        size = capacity * RECORD.itemsize
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+        self.records = np.memmap(path, dtype=RECORD, mode="r+", shape=(capacity,))
+        self.seq = self.records["seq"]
+
+    def write(self, sensor_id, data: dict):
+        if not 0 <= sensor_id < self.capacity:
+            return False
+        row = self.records[sensor_id]
+        self.seq[sensor_id] += 1
+        row["last_seen"] = to_micros(data["last_seen"])
+        for field in FIELDS:
+            value = data.get(field)
+            row[field] = np.nan if value is None else value
+        self.seq[sensor_id] += 1
+        return True
+
+    def clear(self, sensor_id):
+        # El comptador no torna mai enrere, un lector a mitges ho detecta igual que amb write
+        if not 0 <= sensor_id < self.capacity:
+            return False
+        row = self.records[sensor_id]
+        self.seq[sensor_id] += 1
+        row["last_seen"] = EMPTY
+        for field in FIELDS:
+            row[field] = np.nan
+        self.seq[sensor_id] += 1
+        return True
+
+    def invalidate(self):
+        # Buida totes les posicions: el que hi havia pot ser d'abans d'un reinici o d'un
+        # tall del pub/sub, i els lectors tornen a Redis fins que arriba una lectura nova
+        self.seq += 1
+        self.records["last_seen"] = EMPTY
+        for field in FIELDS:
+            self.records[field] = np.nan
+        self.seq += 1
+
+    def read(self, sensor_id, retries=100):
+        if not 0 <= sensor_id < self.capacity:
+            return None
+        for _ in range(retries):
+            before = int(self.seq[sensor_id])
+            if before & 1:
+                continue
+            record = self.records[sensor_id].copy()
+            if int(self.seq[sensor_id]) == before:
+                break
+        else:
+            return None
+        if before == 0 or record["last_seen"] == EMPTY:
+            return None
+        reading = {"id": sensor_id, "last_seen": format_last_seen(record["last_seen"])}
+        for field in FIELDS:
+            reading[field] = None if np.isnan(record[field]) else float(record[field])
+        return reading
+
+
+def start_listener(table: LatestTable, redis_host):
+    # Tots els workers engeguen el fil, però només el que aconsegueix el lock
+    # del fitxer escriu; si aquest worker mor, un altre pren el relleu
+    def listen():
+        lock = open(table.path + ".lock", "w")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        while True:
+            try:
+                redis = RedisClient(host=redis_host)
+                pubsub = redis.pubsub()
+                pubsub.subscribe(LATEST_CHANNEL)
+                # Les publicacions perdudes abans de subscriure's no es recuperen: buidem la taula
+                table.invalidate()
+                for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    reading = json.loads(message["data"])
+                    if reading.get("deleted"):
+                        table.clear(reading["id"])
+                    else:
+                        table.write(reading.pop("id"), reading)
+            except Exception as e:
+                print("Latest table listener error:", e)
+                time.sleep(5)
+
+    thread = threading.Thread(target=listen, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,26 @@
+import os
+import socket
+from typing import List
+
+from shared.redis_client import RedisClient
+
+MEMBERS_PREFIX = "consumers:"
+
+
+class Membership:
+    # Registre dels workers vius a Redis: cada worker renova la seva clau i
+    # la clau caduca sola si el worker cau
+    def __init__(self, redis: RedisClient, worker_id=None, ttl=15):
+        self.redis = redis
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.ttl = ttl
+
+    def heartbeat(self):
+        return self.redis.set(MEMBERS_PREFIX + self.worker_id, 1, ex=self.ttl)
+
+    def members(self) -> List[str]:
+        keys = self.redis.keys(MEMBERS_PREFIX + "*")
+        return sorted(key.decode()[len(MEMBERS_PREFIX):] for key in keys)
+
+    def leave(self):
+        return self.redis.delete(MEMBERS_PREFIX + self.worker_id)
@@ -31,6 +31,16 @@ class MongoDBClient:
         sensor_info = self.collection.find_one(query)
         return sensor_info
     
+    def find(self, query={}, projection=None):
+        self.getDatabase("sensors")
+        self.getCollection("sensorsData")
+        return self.collection.find(query, projection)
+
+    def delete(self, query):
+        self.getDatabase("sensors")
+        self.getCollection("sensorsData")
+        return self.collection.delete_many(query)
+
     def set(self, mydoc):
         self.getDatabase("sensors")
         self.getCollection("sensorsData")
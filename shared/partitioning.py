@@ -0,0 +1,35 @@
+import hashlib
+import os
+from typing import Iterable, List
+
+# Nombre de cues en què es reparteixen les dades dels sensors
+PARTITIONS = int(os.environ.get("QUEUE_PARTITIONS", 8))
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    # Jump consistent hash (Lamping & Veach): si canvia el nombre de particions
+    # només es mou la fracció mínima de claus
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def partition_for(sensor_id: int, partitions: int = PARTITIONS) -> int:
+    # Totes les lectures d'un mateix sensor van sempre a la mateixa partició
+    return jump_hash(int(sensor_id), partitions)
+
+
+def _score(worker_id: str, partition: int) -> int:
+    return int(hashlib.md5(f"{worker_id}:{partition}".encode()).hexdigest(), 16)
+
+
+def assign_partitions(worker_id: str, workers: Iterable[str], partitions: int = PARTITIONS) -> List[int]:
+    # Rendezvous hashing: cada partició és del worker amb la puntuació més alta,
+    # així quan un worker entra o surt només es mouen les seves particions
+    workers = list(workers)
+    if worker_id not in workers:
+        workers.append(worker_id)
+    return [p for p in range(partitions) if max(workers, key=lambda w: _score(w, p)) == worker_id]
@@ -0,0 +1,258 @@
+import contextlib
+import functools
+import inspect
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+
+# Tot queda desactivat si PROFILING no és "on": no s'instal·la cap embolcall ni fil
+PROFILING = os.environ.get("PROFILING", "off") == "on"
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", 500))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 100))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+
+current = ContextVar("profile", default=None)
+
+
+class Profile:
+    # Perfil d'una petició: mostres de pila dels fils que l'executen i crides a cada base de dades
+    def __init__(self, name, forced=False):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.forced = forced
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.duration_ms = None
+        self.threads = set()
+        self.samples = Counter()
+        self.calls = []
+
+    def finish(self):
+        self.duration_ms = (time.perf_counter() - self.start) * 1000
+        return self
+
+    def report(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started": self.started,
+            "duration_ms": self.duration_ms,
+            "forced": self.forced,
+            "samples": sum(self.samples.values()),
+            "interval_ms": PROFILE_INTERVAL * 1000,
+            # Format "collapsed": arrel;...;fulla -> mostres
+            "stacks": [{"stack": ";".join(stack), "count": count} for stack, count in self.samples.most_common()],
+            "calls": self.calls,
+        }
+
+
+def frame_stack(frame, depth=64):
+    stack = []
+    while frame is not None and len(stack) < depth:
+        code = frame.f_code
+        stack.append(f"{os.path.relpath(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+class Sampler(threading.Thread):
+    # Mostreja cada PROFILE_INTERVAL segons la pila dels fils de les peticions en perfil
+    def __init__(self, interval=PROFILE_INTERVAL):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.active = set()
+        self.lock = threading.Lock()
+
+    def add(self, profile):
+        with self.lock:
+            self.active.add(profile)
+
+    def remove(self, profile):
+        with self.lock:
+            self.active.discard(profile)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                active = list(self.active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for profile in active:
+                for thread_id in list(profile.threads):
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        profile.samples[frame_stack(frame)] += 1
+
+
+sampler = None
+
+
+def get_sampler():
+    global sampler
+    if sampler is None:
+        sampler = Sampler()
+        sampler.start()
+    return sampler
+
+
+def should_profile(forced=False):
+    return forced or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+
+
+@contextlib.contextmanager
+def sampled(profile):
+    # Mentre dura el bloc, el sampler també mostreja el fil actual per a `profile`
+    thread_id = threading.get_ident()
+    profile.threads.add(thread_id)
+    try:
+        yield
+    finally:
+        profile.threads.discard(thread_id)
+
+
+def attach_thread(fn):
+    # Embolcalla una funció síncrona perquè el fil que l'executa es mostregi si hi ha un perfil actiu
+    if inspect.isgeneratorfunction(fn):
+        return attach_generator(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile = current.get()
+        if profile is None:
+            return fn(*args, **kwargs)
+        with sampled(profile):
+            return fn(*args, **kwargs)
+    wrapper.attached = True
+    return wrapper
+
+
+def attach_generator(fn):
+    # Dependències amb yield (get_db, get_cassandra_client...): FastAPI executa la part
+    # d'abans del yield i la de després en fils del threadpool potser diferents, així
+    # que es registra el fil a cada represa del generador
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile = current.get()
+        generator = fn(*args, **kwargs)
+        if profile is None:
+            return (yield from generator)
+        value, error = None, None
+        while True:
+            with sampled(profile):
+                try:
+                    item = generator.throw(error) if error is not None else generator.send(value)
+                except StopIteration as stop:
+                    return stop.value
+            value, error = None, None
+            try:
+                value = yield item
+            except BaseException as e:
+                error = e
+    wrapper.attached = True
+    return wrapper
+
+
+def instrument(cls, backend):
+    # Registra cada crida als mètodes públics del client mentre hi ha un perfil actiu
+    for name, method in list(vars(cls).items()):
+        if name.startswith("_") or not callable(method):
+            continue
+
+        def wrap(method, name):
+            @functools.wraps(method)
+            def wrapper(*args, **kwargs):
+                profile = current.get()
+                if profile is None:
+                    return method(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    profile.calls.append({"backend": backend, "method": name,
+                                          "at_ms": (start - profile.start) * 1000,
+                                          "duration_ms": (time.perf_counter() - start) * 1000})
+            return wrapper
+        setattr(cls, name, wrap(method, name))
+
+
+def instrument_clients():
+    from shared.redis_client import RedisClient
+    from shared.mongodb_client import MongoDBClient
+    from shared.elasticsearch_client import ElasticsearchClient
+    from shared.timescale import Timescale
+    from shared.cassandra_client import CassandraClient
+    for cls, backend in [(RedisClient, "redis"), (MongoDBClient, "mongodb"), (ElasticsearchClient, "elasticsearch"),
+                         (Timescale, "timescale"), (CassandraClient, "cassandra")]:
+        instrument(cls, backend)
+
+
+class ReportRing:
+    # Últims PROFILE_KEEP informes com a fitxers JSON; compartit pels workers del mateix host
+    def __init__(self, directory=PROFILE_DIR, keep=PROFILE_KEEP):
+        self.directory = directory
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+
+    def _files(self):
+        files = [name for name in os.listdir(self.directory) if name.endswith(".json")]
+        return sorted(files, key=lambda name: os.path.getmtime(os.path.join(self.directory, name)))
+
+    def save(self, profile):
+        path = os.path.join(self.directory, profile.id + ".json")
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(profile.report(), f)
+        os.replace(tmp, path)
+        for name in self._files()[:-self.keep]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def list(self):
+        reports = []
+        for name in reversed(self._files()):
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    report = json.load(f)
+            except (OSError, ValueError):
+                continue
+            reports.append({key: report[key] for key in ("id", "name", "started", "duration_ms", "forced", "samples")})
+        return reports
+
+    def get(self, report_id):
+        path = os.path.join(self.directory, os.path.basename(report_id) + ".json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+
+def profiled(fn, name, ring, slow_ms=PROFILE_SLOW_MS):
+    # Hook per a funcions que no són peticions HTTP, com el callback del consumidor
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not should_profile():
+            return fn(*args, **kwargs)
+        profile = Profile(name)
+        token = current.set(profile)
+        profile.threads.add(threading.get_ident())
+        get_sampler().add(profile)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            get_sampler().remove(profile)
+            current.reset(token)
+            if profile.finish().duration_ms >= slow_ms:
+                ring.save(profile)
+    return wrapper
@@ -1,7 +1,34 @@
+import os
 import pika
 import time
 
+from shared.partitioning import PARTITIONS, partition_for
+
 QUEUE_NAME = 'test'
+EXCHANGE_NAME = 'sensor_data'
+ALERTS_QUEUE_NAME = 'alerts'
+PURGE_QUEUE_NAME = 'purge'
+
+# Les alertes no tenen cap consumidor fix: la cua es limita i descarta les més antigues
+ALERTS_MAX_LENGTH = int(os.environ.get("ALERTS_MAX_LENGTH", 10000))
+ALERTS_TTL_MS = int(os.environ.get("ALERTS_TTL_MS", 24 * 3600 * 1000))
+QUEUE_ARGUMENTS = {
+    ALERTS_QUEUE_NAME: {"x-max-length": ALERTS_MAX_LENGTH, "x-overflow": "drop-head", "x-message-ttl": ALERTS_TTL_MS},
+}
+
+
+def partition_queue(partition):
+    return f"{QUEUE_NAME}.{partition}"
+
+
+def declare_partitions(channel, partitions=PARTITIONS):
+    # Una cua per partició amb un sol consumidor actiu, així l'ordre per sensor es manté.
+    # Durables i amb missatges persistents: el spool esborra el que el broker ja ha confirmat
+    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='direct', durable=True)
+    for partition in range(partitions):
+        channel.queue_declare(queue=partition_queue(partition), durable=True, arguments={"x-single-active-consumer": True})
+        channel.queue_bind(queue=partition_queue(partition), exchange=EXCHANGE_NAME, routing_key=str(partition))
+
 
 class Publisher:
 
@@ -21,13 +48,31 @@ class Publisher:
             self.conn = pika.BlockingConnection(parameters)
 
         self.channel = self.conn.channel()
+        # Amb confirmacions, basic_publish no torna fins que el broker té el missatge (o llança una excepció)
+        self.channel.confirm_delivery()
         self.channel.queue_declare(queue=QUEUE_NAME)
+        declare_partitions(self.channel)
+
 
 
-    
-    def publish(self, message):
-        self.channel.basic_publish(exchange='', routing_key=QUEUE_NAME, body=message.to_json())
+    def publish(self, message, sensor_id=None):
+        if sensor_id is None:
+            self.channel.basic_publish(exchange='', routing_key=QUEUE_NAME, body=message.json())
+        else:
+            self.publish_body(message.json(), sensor_id)
         print(" [x] Sent %r" % message)
-    
+
+    def publish_body(self, body, sensor_id):
+        # Publica un SensorData ja serialitzat a la partició del sensor
+        self.channel.basic_publish(exchange=EXCHANGE_NAME, routing_key=str(partition_for(sensor_id)), body=body,
+                                   properties=pika.BasicProperties(headers={"sensor_id": sensor_id}, delivery_mode=2),
+                                   mandatory=True)
+
+    def publish_job(self, queue, body):
+        # Cua durable i missatge persistent: una feina no es perd si RabbitMQ es reinicia
+        self.channel.queue_declare(queue=queue, durable=True)
+        self.channel.basic_publish(exchange='', routing_key=queue, body=body,
+                                   properties=pika.BasicProperties(delivery_mode=2))
+
     def close(self):
         self.conn.close()
@@ -0,0 +1,61 @@
+import json
+import os
+import time
+import uuid
+from typing import Optional
+
+from shared.redis_client import RedisClient
+
+JOB_PREFIX = "purge:"
+# Ids dels sensors esborrats: els consumidors descarten les lectures que encara arribin
+DELETED_KEY = "sensors:deleted"
+
+# Segons que es guarda l'estat d'una feina de purga un cop creada (per defecte 7 dies)
+JOB_TTL = int(os.environ.get("PURGE_JOB_TTL", 7 * 24 * 3600))
+
+# Passos d'una purga en ordre; cada missatge de la cua n'executa un lot
+STEPS = ["plan", "mongodb", "elasticsearch", "redis", "cassandra_days", "cassandra", "timescale", "sweep"]
+
+
+def new_job(sensor_id: int, sensor_type: Optional[str]) -> dict:
+    now = time.time()
+    return {
+        "job_id": uuid.uuid4().hex,
+        "sensor_id": sensor_id,
+        "sensor_type": sensor_type,
+        "status": "queued",
+        "step": STEPS[0],
+        "cursor": None,
+        "batch": 0,
+        "attempts": 0,
+        "created_at": now,
+        "updated_at": now,
+        "stores": {},
+        "deleted": 0,
+        "reclaimed_bytes": 0,
+        "error": None,
+    }
+
+
+def save_job(redis: RedisClient, job: dict):
+    job["updated_at"] = time.time()
+    redis.set(JOB_PREFIX + job["job_id"], json.dumps(job), ex=JOB_TTL)
+
+
+def get_job(redis: RedisClient, job_id: str) -> Optional[dict]:
+    raw = redis.get(JOB_PREFIX + job_id)
+    return json.loads(raw) if raw is not None else None
+
+
+def mark_deleted(redis: RedisClient, sensor_id: int):
+    return redis.sadd(DELETED_KEY, sensor_id)
+
+
+def unmark_deleted(redis: RedisClient, sensor_id: int):
+    # Un cop purgat el sensor ja no té document a MongoDB i els consumidors en descarten
+    # les lectures igualment: el conjunt només guarda els que estan pendents de purga
+    return redis.srem(DELETED_KEY, sensor_id)
+
+
+def deleted_sensors(redis: RedisClient) -> set:
+    return {int(member) for member in redis.smembers(DELETED_KEY)}
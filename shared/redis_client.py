@@ -16,9 +16,30 @@ class RedisClient:
     def get(self, key):
         return self._client.get(key)
     
-    def set(self, key, value):
-        return self._client.set(key, value)
+    def set(self, key, value, ex=None, nx=False):
+        return self._client.set(key, value, ex=ex, nx=nx)
+
+    def incr(self, key):
+        return self._client.incr(key)
     
+    def publish(self, channel, message):
+        return self._client.publish(channel, message)
+
+    def pubsub(self):
+        return self._client.pubsub(ignore_subscribe_messages=True)
+
+    def sadd(self, key, *values):
+        return self._client.sadd(key, *values)
+
+    def srem(self, key, *values):
+        return self._client.srem(key, *values)
+
+    def smembers(self, key):
+        return self._client.smembers(key)
+
+    def memory_usage(self, key):
+        return self._client.memory_usage(key)
+
     def delete(self, key):
         return self._client.delete(key)
     
@@ -0,0 +1,78 @@
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+
+BUCKET_UNITS = {"s": "s", "m": "m", "h": "h", "d": "D", "w": "W"}
+
+
+def parse_bucket(bucket: str) -> np.timedelta64:
+    # "15m", "1h", "1d"... a timedelta de NumPy
+    match = re.fullmatch(r"\s*(\d+)\s*([smhdw])\s*", bucket or "")
+    if match is None or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid bucket: {bucket}")
+    return np.timedelta64(int(match.group(1)), BUCKET_UNITS[match.group(2)]).astype("timedelta64[us]")
+
+
+def bucket_start(last_seen: np.ndarray, width: np.timedelta64) -> np.ndarray:
+    # Inici del bucket de cada lectura, alineat a l'època com time_bucket de Timescale
+    ticks = last_seen.astype("datetime64[us]").astype(np.int64)
+    step = width.astype(np.int64)
+    return (ticks - ticks % step).astype("datetime64[us]")
+
+
+def group_aggregate(keys: List[np.ndarray], columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    # Group-by vectoritzat: ordena per les claus i aplica reduceat a cada grup.
+    # Per cada columna retorna avg/min/max ignorant els NaN, i el nombre de lectures del grup
+    n = len(keys[0])
+    order = np.lexsort(keys[::-1])
+    keys = [key[order] for key in keys]
+    change = np.zeros(n, dtype=bool)
+    change[:1] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    starts = np.flatnonzero(change)
+
+    result = {f"key{i}": key[starts] for i, key in enumerate(keys)}
+    result["count"] = np.diff(np.append(starts, n))
+    for name, values in columns.items():
+        values = values[order]
+        if n == 0:
+            for agg in ("avg", "min", "max"):
+                result[f"{name}_{agg}"] = np.empty(0)
+            continue
+        valid = ~np.isnan(values)
+        n_valid = np.add.reduceat(valid, starts)
+        sums = np.add.reduceat(np.where(valid, values, 0.0), starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result[f"{name}_avg"] = np.where(n_valid > 0, sums / n_valid, np.nan)
+        result[f"{name}_min"] = np.fmin.reduceat(values, starts)
+        result[f"{name}_max"] = np.fmax.reduceat(values, starts)
+    return result
+
+
+def to_column(values: np.ndarray):
+    # Columna JSON: dates en ISO; la resta es queda com a array NumPy, que la
+    # resposta orjson escriu sencer (els NaN com a null)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return np.datetime_as_string(values).tolist()
+    return np.ascontiguousarray(values)
+
+
+def aggregate_fleet(ids: np.ndarray, last_seen: np.ndarray, columns: Dict[str, np.ndarray], bucket: Optional[str]) -> dict:
+    # Agregats per sensor (i bucket) i de tota la flota, en format columnar
+    if bucket:
+        starts = bucket_start(last_seen, parse_bucket(bucket))
+        per_sensor = group_aggregate([ids, starts], columns)
+        fleet = group_aggregate([starts], columns)
+        per_sensor = {"id": per_sensor.pop("key0"), "bucket_time": per_sensor.pop("key1"), **per_sensor}
+        fleet = {"bucket_time": fleet.pop("key0"), **fleet}
+    else:
+        per_sensor = group_aggregate([ids], columns)
+        fleet = group_aggregate([np.zeros(len(ids), dtype=np.int64)], columns)
+        per_sensor = {"id": per_sensor.pop("key0"), **per_sensor}
+        fleet.pop("key0")
+    return {
+        "sensors": {name: to_column(values) for name, values in per_sensor.items()},
+        "fleet": {name: to_column(values) for name, values in fleet.items()},
+    }
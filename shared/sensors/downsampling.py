@@ -0,0 +1,61 @@
+import numpy as np
+
+
+def _first_per_bucket(mask, bucket):
+    # Primer índex de cada bucket on `mask` és cert
+    idx = np.flatnonzero(mask)
+    _, first = np.unique(bucket[idx], return_index=True)
+    return idx[first]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    # Largest-Triangle-Three-Buckets: retorna els índexs dels punts a conservar.
+    # Les mitjanes dels buckets es calculen de cop; el bucle és d'un pas per bucket
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    sizes = np.diff(edges)
+    avg_x = np.add.reduceat(x[:-1], edges[:-1]) / sizes
+    avg_y = np.add.reduceat(y[:-1], edges[:-1]) / sizes
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs((x[a] - next_x[i]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y[i] - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax(y: np.ndarray, n_out: int) -> np.ndarray:
+    # Mínim i màxim de cada bucket, tot vectoritzat: n_out // 2 buckets de mida igual
+    n = len(y)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+    n_buckets = n_out // 2
+    edges = np.linspace(0, n, n_buckets + 1).astype(np.int64)
+    bucket = np.repeat(np.arange(n_buckets), np.diff(edges))
+    mins = np.minimum.reduceat(y, edges[:-1])
+    maxs = np.maximum.reduceat(y, edges[:-1])
+    first_min = _first_per_bucket(y == mins[bucket], bucket)
+    first_max = _first_per_bucket(y == maxs[bucket], bucket)
+    return np.unique(np.concatenate([first_min, first_max]))
+
+
+METHODS = {
+    "lttb": lambda x, y, n_out: lttb(x, y, n_out),
+    "minmax": lambda x, y, n_out: minmax(y, n_out),
+}
+
+
+def downsample(last_seen: np.ndarray, values: np.ndarray, max_points: int, method: str = "lttb") -> np.ndarray:
+    # `last_seen` és datetime64 ordenat; retorna els índexs seleccionats ignorant els valors nuls
+    valid = np.flatnonzero(~np.isnan(values))
+    x = last_seen[valid].astype("datetime64[us]").astype(np.int64).astype(np.float64)
+    return valid[METHODS[method](x, values[valid], max_points)]
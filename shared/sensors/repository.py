@@ -1,20 +1,31 @@
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from shared.redis_client import RedisClient
 from shared.mongodb_client import MongoDBClient
 from shared.elasticsearch_client import ElasticsearchClient
 from shared.timescale import Timescale
 from shared.cassandra_client import CassandraClient
+from shared.cache import bump_version
+from shared.publisher import Publisher, PURGE_QUEUE_NAME
+from shared import purge
+from shared.latest_table import LatestTable, LATEST_CHANNEL, format_last_seen, to_micros
+from shared.serialization import format_joined_at, reading_rows
 import json
-from . import models, schemas
-from datetime import datetime
+import base64
+from . import models, schemas, downsampling, aggregation
+import numpy as np
+from datetime import datetime, timedelta, timezone
 
 def get_sensor(db: Session, sensor_id: int, mongodb: MongoDBClient) -> Optional[models.Sensor]:
     db_sensor = db.query(models.Sensor).filter(models.Sensor.id == sensor_id).first()
+    if db_sensor is None:
+        return None #esborrat (o inexistent): la purga encara pot no haver netejat la resta de bases de dades
     mongo_sensor = mongodb.get({"id": sensor_id})
-    
+    if mongo_sensor is None:
+        return None
+
     sensor = {
         "id" : db_sensor.id,
         "name": db_sensor.name,
@@ -27,7 +38,7 @@ def get_sensor(db: Session, sensor_id: int, mongodb: MongoDBClient) -> Optional[
         "serie_number": mongo_sensor["serie_number"], 
         "firmware_version": mongo_sensor["firmware_version"], 
         "description": mongo_sensor["description"],
-        "joined_at" : db_sensor.joined_at.strftime("%m/%d/%Y, %H:%M:%S")
+        "joined_at" : format_joined_at(db_sensor.joined_at)
     }
 
     return sensor
@@ -35,8 +46,87 @@ def get_sensor(db: Session, sensor_id: int, mongodb: MongoDBClient) -> Optional[
 def get_sensor_by_name(db: Session, name: str) -> Optional[models.Sensor]:
     return db.query(models.Sensor).filter(models.Sensor.name == name).first()
 
-def get_sensors(db: Session, skip: int = 0, limit: int = 100) -> List[models.Sensor]:
-    return db.query(models.Sensor).offset(skip).limit(limit).all()
+# Camps que es poden demanar a GET /sensors i de quina base de dades surten
+SQL_FIELDS = ["id", "name", "joined_at"]
+MONGO_FIELDS = ["latitude", "longitude", "type", "mac_address", "manufacturer", "model", "serie_number", "firmware_version", "description"]
+DEFAULT_FIELDS = SQL_FIELDS
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode()
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode()))["id"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return DEFAULT_FIELDS
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in selected if field not in SQL_FIELDS + MONGO_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return selected
+
+#pagina per clau (id > ultim id vist) en lloc d'OFFSET, el cost no creix amb la profunditat
+def get_sensors(db: Session, mongodb: Optional[MongoDBClient] = None, limit: int = 100, after_id: Optional[int] = None, fields: List[str] = DEFAULT_FIELDS) -> List[dict]:
+    query = db.query(models.Sensor.id, models.Sensor.name, models.Sensor.joined_at)
+    if after_id is not None:
+        query = query.filter(models.Sensor.id > after_id)
+    rows = query.order_by(models.Sensor.id).limit(limit).all()
+
+    mongo_fields = [field for field in fields if field in MONGO_FIELDS]
+    mongo_sensors = {}
+    if mongo_fields and rows:
+        #una sola consulta a MongoDB per tota la pagina, nomes amb els camps demanats
+        projection = {"_id": 0, "id": 1}
+        for field in mongo_fields:
+            projection["location" if field in ("latitude", "longitude") else field] = 1
+        for mongo_sensor in mongodb.find({"id": {"$in": [row.id for row in rows]}}, projection):
+            mongo_sensors[mongo_sensor["id"]] = mongo_sensor
+
+    sensors = []
+    for row in rows:
+        sensor = {}
+        mongo_sensor = mongo_sensors.get(row.id, {})
+        for field in fields:
+            if field == "joined_at":
+                sensor[field] = format_joined_at(row.joined_at) if row.joined_at else None
+            elif field in SQL_FIELDS:
+                sensor[field] = getattr(row, field)
+            elif field == "latitude":
+                sensor[field] = mongo_sensor["location"]["coordinates"][0] if "location" in mongo_sensor else None
+            elif field == "longitude":
+                sensor[field] = mongo_sensor["location"]["coordinates"][1] if "location" in mongo_sensor else None
+            else:
+                sensor[field] = mongo_sensor.get(field)
+        sensors.append(sensor)
+    return sensors
+
+def get_sensors_page(db: Session, mongodb: MongoDBClient, limit: int, cursor: Optional[str], fields: List[str]) -> dict:
+    after_id = decode_cursor(cursor) if cursor else None
+    sensors = get_sensors(db=db, mongodb=mongodb, limit=limit, after_id=after_id, fields=["id"] + [field for field in fields if field != "id"])
+    next_cursor = encode_cursor(sensors[-1]["id"]) if len(sensors) == limit else None
+    if "id" not in fields:
+        for sensor in sensors:
+            del sensor["id"]
+    return {"sensors": sensors, "next_cursor": next_cursor}
+
+#recorre tots els sensors pagina a pagina, la memoria no depen de la mida de la flota
+def iter_sensors(db: Session, mongodb: MongoDBClient, fields: List[str], batch_size: int = 1000):
+    after_id = None
+    while True:
+        sensors = get_sensors(db=db, mongodb=mongodb, limit=batch_size, after_id=after_id, fields=["id"] + [field for field in fields if field != "id"])
+        if not sensors:
+            return
+        after_id = sensors[-1]["id"]
+        for sensor in sensors:
+            if "id" not in fields:
+                del sensor["id"]
+            yield sensor
+        if len(sensors) < batch_size:
+            return
 
 def create_sensor(sensor: schemas.SensorCreate, db: Session, mongodb: MongoDBClient, es: ElasticsearchClient) -> dict:
     db_sensor = models.Sensor(name=sensor.name) #Afegir el sensor en la base SQL
@@ -101,26 +191,22 @@ def create_sensor(sensor: schemas.SensorCreate, db: Session, mongodb: MongoDBCli
 
     return sensor
 
-#metode per registrar nous dades, per parametre pasem les dues bases de dades, la id del sensor i les noves dades
-def record_data(db: Session,redis: RedisClient, sensor_id: int, data: schemas.SensorData, mongodb:MongoDBClient, ts:Timescale, cassandra:CassandraClient) -> Optional[schemas.Sensor]:
-
+#data en UTC (les dates sense zona es consideren UTC, com fa Cassandra)
+def utc(moment: datetime) -> datetime:
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
 
+#dia UTC d'una lectura, la segona part de la clau de particio de sensor_temperature_by_day
+def reading_day(last_seen: str) -> str:
+    return utc(datetime.fromisoformat(last_seen.replace("Z", "+00:00"))).date().isoformat()
 
-    try: #control d'excepcions
-        serialized_data = json.dumps(data.dict()) #serialitzem les dades per a que es pugui fer el set en radis
-        redis.set(sensor_id,serialized_data) #cridem el metode setter per actualizar les dades 
-        db_sensordata_serie = redis.get(sensor_id) #cridem el metode getter per obtenir les dades actualitzades del sensor
-        db_sensordata = schemas.SensorData.parse_raw(db_sensordata_serie) #deserialitzem les dades per poder accedir a elles
-        db_sensor = get_sensor(db,sensor_id, mongodb) #cridem el metode per obtenir el sensor actual    
-        mongo_sensor=mongodb.get({"id": sensor_id})
-        sensor = schemas.Sensor(id = db_sensor["id"], name = db_sensor["name"],
-                                    latitude = mongo_sensor["location"]["coordinates"][0], longitude=mongo_sensor["location"]["coordinates"][1],
-                                    joined_at=db_sensor["joined_at"], 
-                                    last_seen=db_sensordata.last_seen, type=mongo_sensor['type'], mac_address=mongo_sensor["mac_address"],
-                                    temperature=db_sensordata.temperature, 
-                                    humidity=db_sensordata.humidity, battery_level=db_sensordata.battery_level,
-                                    velocity=db_sensordata.velocity,
-                                    description=mongo_sensor["description"]) #creem un nou sensor amb totes les dades    
+#escriu totes les lectures als magatzems historics (Timescale i sensor_temperature_by_day), en un sol INSERT idempotent per si el broker les torna a lliurar
+def store_readings(ts: Timescale, cassandra: CassandraClient, readings: List[Tuple[int, schemas.SensorData]]):
+    if not readings:
+        return
+    rows = []
+    for sensor_id, data in readings:
         temperature = "NULL"
         humidity = "NULL"
         velocity = "NULL"
@@ -130,34 +216,83 @@ def record_data(db: Session,redis: RedisClient, sensor_id: int, data: schemas.Se
             humidity = data.humidity
         if data.velocity:
             velocity = data.velocity
-        query = f"INSERT INTO sensor_data (id, velocity, temperature, humidity, last_seen, battery_level) VALUES ({sensor_id}, {velocity}, {temperature}, {humidity}, '{data.last_seen}', {data.battery_level})"
-        ts.execute(query)
-        ts.conn.commit()   
-        cassandra.create_tables()
+        rows.append(f"({sensor_id}, {velocity}, {temperature}, {humidity}, '{data.last_seen}', {data.battery_level})")
+    query = f"INSERT INTO sensor_data (id, velocity, temperature, humidity, last_seen, battery_level) VALUES {', '.join(rows)} ON CONFLICT DO NOTHING"
+    ts.execute(query)
+    ts.conn.commit()   
+    cassandra.create_tables()
+    for sensor_id, data in readings:
         if data.temperature is not None:
-            query_temp = f"INSERT INTO sensor.sensor_temperature (id, last_seen, temperature) VALUES ({sensor_id}, '{data.last_seen}', {data.temperature})"
+            query_temp = f"INSERT INTO sensor.sensor_temperature_by_day (id, day, last_seen, temperature) VALUES ({sensor_id}, '{reading_day(data.last_seen)}', '{data.last_seen}', {data.temperature})"
             cassandra.execute(query_temp)
-        query_type = f"INSERT INTO sensor.sensor_type (id, type) VALUES ({sensor_id}, '{mongo_sensor['type']}')"
+
+#escriu nomes l'ultim estat de cada sensor als magatzems on l'ultima escriptura guanya (Redis, sensor_type i sensor_battery)
+def store_latest(redis: RedisClient, cassandra: CassandraClient, latest: Dict[int, Tuple[schemas.SensorData, str]]):
+    if not latest:
+        return
+    cassandra.create_tables()
+    for sensor_id, (data, sensor_type) in latest.items():
+        serialized_data = json.dumps(data.dict()) #serialitzem les dades per a que es pugui fer el set en radis
+        redis.set(sensor_id,serialized_data) #cridem el metode setter per actualizar les dades 
+        redis.publish(LATEST_CHANNEL, json.dumps({"id": sensor_id, **data.dict()})) #avisa les taules d'ultim estat en memoria compartida
+        query_type = f"INSERT INTO sensor.sensor_type (id, type) VALUES ({sensor_id}, '{sensor_type}')"
         cassandra.execute(query_type)
         query_battery = f"INSERT INTO sensor.sensor_battery (id, battery_level) VALUES ({sensor_id}, {data.battery_level})"
         cassandra.execute(query_battery)
+    bump_version(redis) #invalida els resultats analitics en cache
+
+#escriu una lectura a tots els magatzems de dades (Redis, Timescale i Cassandra)
+def store_data(redis: RedisClient, ts: Timescale, cassandra: CassandraClient, sensor_id: int, data: schemas.SensorData, sensor_type: str):
+    store_readings(ts=ts, cassandra=cassandra, readings=[(sensor_id, data)])
+    store_latest(redis=redis, cassandra=cassandra, latest={sensor_id: (data, sensor_type)})
+
+#metode per registrar nous dades, per parametre pasem les dues bases de dades, la id del sensor i les noves dades
+def record_data(db: Session,redis: RedisClient, sensor_id: int, data: schemas.SensorData, mongodb:MongoDBClient, ts:Timescale, cassandra:CassandraClient) -> Optional[schemas.Sensor]:
+
+
+
+    try: #control d'excepcions
+        db_sensor = get_sensor(db,sensor_id, mongodb) #cridem el metode per obtenir el sensor actual    
+        mongo_sensor=mongodb.get({"id": sensor_id})
+        store_data(redis=redis, ts=ts, cassandra=cassandra, sensor_id=sensor_id, data=data, sensor_type=mongo_sensor['type'])
+        sensor = schemas.Sensor(id = db_sensor["id"], name = db_sensor["name"],
+                                    latitude = mongo_sensor["location"]["coordinates"][0], longitude=mongo_sensor["location"]["coordinates"][1],
+                                    joined_at=db_sensor["joined_at"], 
+                                    last_seen=data.last_seen, type=mongo_sensor['type'], mac_address=mongo_sensor["mac_address"],
+                                    temperature=data.temperature, 
+                                    humidity=data.humidity, battery_level=data.battery_level,
+                                    velocity=data.velocity,
+                                    description=mongo_sensor["description"]) #creem un nou sensor amb totes les dades    
         return sensor 
     except:
         raise HTTPException(status_code=404, detail="Sensor not found") #excepció en cas de que no existi el sensor
 
 def get_temperature_values(db: Session, cassandra:CassandraClient, mongodb: MongoDBClient):
+    #agreguem per particio (sensor, dia) i combinem els dies de cada sensor
     query = """
     SELECT id,
         MAX(temperature) AS max_value,
         MIN(temperature) AS min_value,
-        AVG(temperature) AS avg_value
-    FROM sensor.sensor_temperature
-    GROUP BY id;
+        SUM(temperature) AS sum_value,
+        COUNT(temperature) AS count_value
+    FROM sensor.sensor_temperature_by_day
+    GROUP BY id, day;
     """
-    sensors = cassandra.execute(query)
+    per_sensor = {}
+    for row in cassandra.execute(query):
+        if row[0] not in per_sensor:
+            per_sensor[row[0]] = [row[1], row[2], 0.0, 0]
+        values = per_sensor[row[0]]
+        values[0] = max(values[0], row[1])
+        values[1] = min(values[1], row[2])
+        values[2] += row[3]
+        values[3] += row[4]
+    sensors = [(sensor_id, values[0], values[1], values[2] / values[3]) for sensor_id, values in sorted(per_sensor.items())]
     resultat = []
     for sensor in sensors:
         db_sensor = get_sensor(db,sensor[0], mongodb)
+        if db_sensor is None:
+            continue #files d'un sensor esborrat que la purga encara no ha tret
         resultat.append({"id": sensor[0], 
                          "name": db_sensor["name"], 
                          "latitude": db_sensor["latitude"], 
@@ -175,6 +310,27 @@ def get_temperature_values(db: Session, cassandra:CassandraClient, mongodb: Mong
     
     return {"sensors":resultat}
 
+#lectures de temperatura d'un sensor entre dues dates, consultant nomes les particions dels dies del rang en paral·lel
+def get_temperature_range(cassandra: CassandraClient, sensor_id: int, from_date: datetime, to_date: datetime, max_days: int = 366):
+    from_date, to_date = utc(from_date), utc(to_date) #una data pot venir amb zona i l'altra sense
+    if to_date < from_date:
+        raise HTTPException(status_code=400, detail="to must be after from_date")
+    first_day, last_day = from_date.date(), to_date.date()
+    days = (last_day - first_day).days + 1
+    if days > max_days:
+        raise HTTPException(status_code=400, detail=f"Range too long, at most {max_days} days")
+    cassandra.create_tables()
+    statement = cassandra.prepare(
+        "SELECT last_seen, temperature FROM sensor.sensor_temperature_by_day WHERE id = ? AND day = ? AND last_seen >= ? AND last_seen <= ?")
+    params = [(sensor_id, first_day + timedelta(days=i), from_date, to_date) for i in range(days)]
+    readings = []
+    for success, rows in cassandra.execute_concurrent(statement, params):
+        if not success:
+            raise rows
+        for row in rows:
+            readings.append({"last_seen": row.last_seen, "temperature": row.temperature}) #la resposta orjson escriu la data en ISO
+    return {"id": sensor_id, "readings": readings}
+
 def get_sensors_quantity(db: Session, cassandra:CassandraClient):
     query = """SELECT type, COUNT(*) AS type_count
         FROM sensor.sensor_type
@@ -197,6 +353,8 @@ def get_low_battery_sensors(db: Session, cassandra:CassandraClient, mongodb: Mon
     resultat = []
     for sensor in result:
         db_sensor = get_sensor(db,sensor[0], mongodb)
+        if db_sensor is None:
+            continue #files d'un sensor esborrat que la purga encara no ha tret
         resultat.append({"id": sensor[0], 
                          "name": db_sensor["name"], 
                          "latitude": db_sensor["latitude"], 
@@ -211,6 +369,79 @@ def get_low_battery_sensors(db: Session, cassandra:CassandraClient, mongodb: Mon
                          "battery_level": sensor[1]})
     return {"sensors":resultat}
 
+DATA_FIELDS = ["temperature", "humidity", "velocity", "battery_level"]
+
+#llegeix les lectures crues de diversos sensors de Timescale com a columnes NumPy, amb una sola consulta
+def get_fleet_columns(ts: Timescale, sensor_ids: List[int], from_date: Optional[datetime], to_date: Optional[datetime]) -> Dict[str, np.ndarray]:
+    conditions = ["id = ANY(%(ids)s)"]
+    if from_date:
+        conditions.append("last_seen >= %(from_date)s")
+    if to_date:
+        conditions.append("last_seen <= %(to_date)s")
+    query = f"SELECT id, last_seen, {', '.join(DATA_FIELDS)} FROM sensor_data WHERE {' AND '.join(conditions)} ORDER BY id, last_seen"
+    ts.execute(query, {"ids": list(sensor_ids), "from_date": from_date, "to_date": to_date})
+    rows = ts.cursor.fetchall()
+    columns = {
+        "id": np.array([row[0] for row in rows], dtype=np.int64),
+        "last_seen": np.array([row[1] for row in rows], dtype="datetime64[us]"),
+    }
+    for i, field in enumerate(DATA_FIELDS, start=2):
+        columns[field] = np.array([row[i] for row in rows], dtype=np.float64) #els NULL passen a NaN
+    return columns
+
+def get_data_columns(ts: Timescale, sensor_id: int, from_date: Optional[datetime], to_date: Optional[datetime]) -> Dict[str, np.ndarray]:
+    columns = get_fleet_columns(ts=ts, sensor_ids=[sensor_id], from_date=from_date, to_date=to_date)
+    del columns["id"]
+    return columns
+
+#retorna com a molt max_points lectures triades amb LTTB o min-max sobre el camp indicat
+#(sense camp, el primer que el sensor informa: temperatura per als de temperatura, velocitat per als de velocitat)
+def get_data_downsampled(ts: Timescale, sensor_id: int, from_date: Optional[datetime], to_date: Optional[datetime], max_points: int, method: str, field: Optional[str] = None):
+    if method not in downsampling.METHODS:
+        raise HTTPException(status_code=400, detail=f"Unknown downsampling method: {method}")
+    if field is not None and field not in DATA_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Unknown field: {field}")
+    columns = get_data_columns(ts=ts, sensor_id=sensor_id, from_date=from_date, to_date=to_date)
+    reported = [name for name in DATA_FIELDS if not np.isnan(columns[name]).all()]
+    if field is None:
+        field = reported[0] if reported else DATA_FIELDS[0]
+    elif len(columns["last_seen"]) and field not in reported:
+        #el downsampling descarta els nuls: sense cap valor la resposta seria buida tot i haver-hi lectures
+        raise HTTPException(status_code=400, detail=f"Sensor has no {field} readings")
+    idx = downsampling.downsample(columns["last_seen"], columns[field], max_points, method)
+    return reading_rows(columns["last_seen"][idx], {name: columns[name][idx] for name in DATA_FIELDS})
+
+#agregats per sensor i de tota la flota per una llista de sensors o un tipus, en format columnar
+def get_fleet_data(ts: Timescale, mongodb: MongoDBClient, sensor_ids: Optional[List[int]], sensor_type: Optional[str], from_date: Optional[datetime], to_date: Optional[datetime], bucket: Optional[str], fields: List[str]):
+    if not sensor_ids and not sensor_type:
+        raise HTTPException(status_code=400, detail="Either ids or type is required")
+    unknown = [field for field in fields if field not in DATA_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    ids = set(sensor_ids or [])
+    if sensor_type:
+        type_ids = {sensor["id"] for sensor in mongodb.find({"type": sensor_type}, {"_id": 0, "id": 1})}
+        ids = ids & type_ids if sensor_ids else type_ids
+    columns = get_fleet_columns(ts=ts, sensor_ids=sorted(ids), from_date=from_date, to_date=to_date)
+    try:
+        result = aggregation.aggregate_fleet(columns["id"], columns["last_seen"], {field: columns[field] for field in fields}, bucket)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"bucket": bucket, **result}
+
+#ultima lectura d'un sensor: de la taula en memoria compartida si hi es, si no de Redis
+def get_latest(redis: RedisClient, sensor_id: int, table: Optional[LatestTable] = None):
+    if table is not None:
+        reading = table.read(sensor_id)
+        if reading is not None:
+            return reading
+    serialized_data = redis.get(sensor_id)
+    if serialized_data is None:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+    reading = {"id": sensor_id, **json.loads(serialized_data)}
+    reading["last_seen"] = format_last_seen(to_micros(reading["last_seen"])) #mateix format que la taula
+    return reading
+
 #metode per obtenir les dades del sensor
 def get_data(db: Session,redis: RedisClient, sensor_id: int, mongodb:MongoDBClient, ts:Timescale, from_date:Optional[datetime], to_date:Optional[datetime], bucket:Optional[str]):
     try:
@@ -250,13 +481,33 @@ def get_data(db: Session,redis: RedisClient, sensor_id: int, mongodb:MongoDBClie
     except:
         raise HTTPException(status_code=404, detail="Sensor not found") #excepció en cas de que no existi el sensor```
 
-def delete_sensor(db: Session, sensor_id: int):
+#esborra el sensor de Postgres i encua la purga de la resta de magatzems, que fan els consumidors per lots
+def delete_sensor(db: Session, sensor_id: int, mongodb: MongoDBClient, redis: RedisClient, publisher: Publisher):
     db_sensor = db.query(models.Sensor).filter(models.Sensor.id == sensor_id).first()
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
+    mongo_sensor = mongodb.get({"id": sensor_id})
+    job = purge.new_job(sensor_id, mongo_sensor["type"] if mongo_sensor else None) #sensor_type es particiona per tipus
     db.delete(db_sensor)
+    db.flush() #si l'esborrat ha de fallar, que falli abans d'encuar la purga
+    purge.save_job(redis, job)
+    # La feina s'encua abans del commit: si RabbitMQ no la confirma el sensor continua
+    # existint i es pot tornar a esborrar, en lloc de quedar esborrat sense purga
+    try:
+        publisher.publish_job(PURGE_QUEUE_NAME, json.dumps({"job_id": job["job_id"], "batch": job["batch"]}))
+    except Exception:
+        db.rollback()
+        raise HTTPException(status_code=503, detail="Broker unavailable")
     db.commit()
-    return db_sensor
+    purge.mark_deleted(redis, sensor_id) #els consumidors deixen d'escriure lectures seves (el pas sweep recull el que s'hagi escrit abans)
+    bump_version(redis) #els resultats analitics en cache encara inclouen el sensor
+    return {"id": sensor_id, "name": db_sensor.name, "job_id": job["job_id"], "status": job["status"]}
+
+def get_purge_job(redis: RedisClient, job_id: str):
+    job = purge.get_job(redis, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Purge job not found")
+    return job
 
 def get_sensors_near(mongodb: MongoDBClient, latitude: float, longitude: float, radius: int, db: Session, redis: RedisClient):
     try:
@@ -323,5 +574,7 @@ def search_sensors(query: str, size: int, search_type: str, db: Session, mongodb
         data = hit['_source']
         id = data['id']
         sensor = get_sensor(db,id,mongodb)
+        if sensor is None:
+            continue
         result.append(sensor)
     return result
\ No newline at end of file
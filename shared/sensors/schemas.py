@@ -1,5 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, validator
 from typing import Optional
+from datetime import datetime
 
 class Sensor(BaseModel):
     id: int
@@ -37,4 +38,10 @@ class SensorData(BaseModel):
     temperature: Optional[float]
     humidity: Optional[float]
     battery_level: float
-    last_seen: str
\ No newline at end of file
+    last_seen: str
+
+    # Només dates ISO 8601: una data mal formada no ha d'arribar a les cues ni al spool
+    @validator("last_seen")
+    def check_last_seen(cls, value):
+        datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return value
\ No newline at end of file
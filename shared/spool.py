@@ -0,0 +1,282 @@
+import fcntl
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Capçalera de cada registre: longitud del cos, crc32 del cos i id del sensor
+HEADER = struct.Struct(">IIi")
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".log"
+
+
+def segment_name(number):
+    return f"{SEGMENT_PREFIX}{number:010d}{SEGMENT_SUFFIX}"
+
+
+def segment_number(name):
+    return int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+
+class Spool:
+    # Registre local només d'afegir, partit en segments. Les escriptures
+    # concurrents comparteixen un sol fsync (group commit): el primer que
+    # espera fa el fsync per tots els registres escrits fins aquell moment
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, sync=True, lock=None):
+        self.directory = directory
+        self.lock = lock
+        self.segment_bytes = segment_bytes
+        self.sync = sync
+        os.makedirs(directory, exist_ok=True)
+        self.cond = threading.Condition()
+        self.written = 0
+        self.synced = 0
+        self.syncing = False
+        self.appended = 0
+        # Mai continuem un segment antic: si el procés va caure pot acabar amb un registre a mitges
+        segments = self.segments()
+        self.segment = (segments[-1] + 1) if segments else 1
+        self.file = open(os.path.join(directory, segment_name(self.segment)), "ab")
+
+    def segments(self):
+        return sorted(segment_number(name) for name in os.listdir(self.directory)
+                      if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+
+    def append(self, sensor_id, body: bytes):
+        with self.cond:
+            if self.file.tell() >= self.segment_bytes:
+                self._rotate()
+            self.file.write(HEADER.pack(len(body), zlib.crc32(body), sensor_id) + body)
+            self.written += 1
+            self.appended += 1
+            seq = self.written
+            if not self.sync:
+                self.file.flush()
+                return
+            while self.synced < seq:
+                if self.syncing:
+                    self.cond.wait()
+                    continue
+                self.syncing = True
+                target = self.written
+                f = self.file
+                f.flush()
+                self.cond.release()
+                try:
+                    os.fsync(f.fileno())
+                finally:
+                    self.cond.acquire()
+                    self.syncing = False
+                    self.synced = max(self.synced, target)
+                    self.cond.notify_all()
+
+    def _rotate(self):
+        # Esperem que acabi el fsync en curs abans de tancar el fitxer
+        while self.syncing:
+            self.cond.wait()
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+        self.synced = self.written
+        self.file.close()
+        self.segment += 1
+        self.file = open(os.path.join(self.directory, segment_name(self.segment)), "ab")
+
+    def close(self):
+        with self.cond:
+            while self.syncing:
+                self.cond.wait()
+            self.file.close()
+
+
+class SpoolReader:
+    # Llegeix el spool des de l'últim offset confirmat i esborra els segments ja buidats
+    def __init__(self, spool: Spool):
+        self.spool = spool
+        self.offset_path = os.path.join(spool.directory, "offset")
+        self.segment, self.position = self._load_offset()
+        self.drained = 0
+
+    def _load_offset(self):
+        try:
+            with open(self.offset_path) as f:
+                segment, position = f.read().split()
+                return int(segment), int(position)
+        except (OSError, ValueError):
+            segments = self.spool.segments()
+            return (segments[0] if segments else 1), 0
+
+    def read(self, max_records=500):
+        # Retorna [(sensor_id, cos)] i l'offset que cal confirmar quan s'hagin publicat
+        records = []
+        segment, position = self.segment, self.position
+        while len(records) < max_records:
+            path = os.path.join(self.spool.directory, segment_name(segment))
+            if not os.path.exists(path):
+                later = [number for number in self.spool.segments() if number > segment]
+                if not later:
+                    break
+                segment, position = later[0], 0
+                continue
+            # Cal saber si el segment ja estava tancat abans de llegir-lo: si el spool rota
+            # mentre llegim, els registres afegits al final es llegiran a la crida següent
+            closed = segment < self.spool.segment
+            with open(path, "rb") as f:
+                f.seek(position)
+                while len(records) < max_records:
+                    header = f.read(HEADER.size)
+                    if len(header) < HEADER.size:
+                        break
+                    length, crc, sensor_id = HEADER.unpack(header)
+                    body = f.read(length)
+                    if len(body) < length or zlib.crc32(body) != crc:
+                        break
+                    records.append((sensor_id, body))
+                    position += HEADER.size + length
+            if len(records) >= max_records or not closed:
+                break
+            # Final d'un segment tancat (o cua trencada després d'una caiguda): passem al següent
+            segment, position = segment + 1, 0
+        return records, (segment, position)
+
+    def commit(self, offset, count):
+        self.segment, self.position = offset
+        tmp = self.offset_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(f"{self.segment} {self.position}")
+        os.replace(tmp, self.offset_path)
+        self.drained += count
+        for number in self.spool.segments():
+            if number < self.segment:
+                os.remove(os.path.join(self.spool.directory, segment_name(number)))
+
+    def depth_bytes(self):
+        depth = 0
+        for number in self.spool.segments():
+            if number >= self.segment:
+                size = os.path.getsize(os.path.join(self.spool.directory, segment_name(number)))
+                depth += size - (self.position if number == self.segment else 0)
+        return depth
+
+
+class SpoolDrainer(threading.Thread):
+    # Reenvia el spool al broker en segon pla; si el broker no respon ho reintenta sense perdre l'ordre.
+    # `connect` ha de donar un publicador amb confirmacions (com Publisher): l'offset només
+    # avança quan publish_body ha tornat, és a dir quan el broker ha confirmat cada registre.
+    # Amb until_empty (spools d'altres workers) s'atura quan l'ha buidat i allibera el directori
+    def __init__(self, spool: Spool, connect, batch=500, idle=0.05, retry=5, until_empty=False):
+        super().__init__(daemon=True)
+        self.reader = SpoolReader(spool)
+        self.connect = connect
+        self.batch = batch
+        self.idle = idle
+        self.retry = retry
+        self.until_empty = until_empty
+        self.publisher = None
+        self.running = True
+        self.rate = 0.0
+        self.last_error = None
+
+    def run(self):
+        while self.running:
+            records, offset = self.reader.read(self.batch)
+            if not records:
+                if offset != (self.reader.segment, self.reader.position):
+                    self.reader.commit(offset, 0)
+                if self.until_empty:
+                    self.release()
+                    break
+                time.sleep(self.idle)
+                continue
+            start = time.monotonic()
+            try:
+                if self.publisher is None:
+                    self.publisher = self.connect()
+                for sensor_id, body in records:
+                    self.publisher.publish_body(body, sensor_id)
+            except Exception as e:
+                self.last_error = str(e)
+                self._disconnect()
+                time.sleep(self.retry)
+                continue
+            self.reader.commit(offset, len(records))
+            elapsed = max(time.monotonic() - start, 1e-6)
+            # Mitjana mòbil exponencial de registres per segon
+            self.rate = 0.8 * self.rate + 0.2 * (len(records) / elapsed) if self.rate else len(records) / elapsed
+
+    def release(self):
+        # Deixa el directori buit (sense segment ni offset) i n'allibera el lock
+        spool = self.reader.spool
+        spool.close()
+        for number in spool.segments():
+            os.remove(os.path.join(spool.directory, segment_name(number)))
+        if os.path.exists(self.reader.offset_path):
+            os.remove(self.reader.offset_path)
+        if spool.lock is not None:
+            spool.lock.close()
+        self._disconnect()
+
+    def _disconnect(self):
+        if self.publisher is not None:
+            try:
+                self.publisher.close()
+            except Exception:
+                pass
+        self.publisher = None
+
+    def stop(self):
+        self.running = False
+
+    def metrics(self):
+        return {
+            "depth_bytes": self.reader.depth_bytes(),
+            "appended": self.reader.spool.appended,
+            "drained": self.reader.drained,
+            "drain_rate": self.rate,
+            "connected": self.publisher is not None,
+            "last_error": self.last_error,
+        }
+
+
+def try_lock(path):
+    lock = open(path, "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+    return lock
+
+
+def claim_slot(base, slots=64):
+    # Primer número de slot lliure a `base`, bloquejat mentre el procés viu. Un procés
+    # reiniciat torna a agafar el mateix slot (sempre es comença pel més baix)
+    os.makedirs(base, exist_ok=True)
+    for slot in range(slots):
+        lock = try_lock(os.path.join(base, f"worker-{slot}.lock"))
+        if lock is not None:
+            return slot, lock
+    raise RuntimeError(f"No free slot in {base}")
+
+
+def claim_directory(base, slots=64):
+    # Cada worker d'uvicorn agafa un subdirectori propi
+    slot, lock = claim_slot(base, slots)
+    return os.path.join(base, f"worker-{slot}"), lock
+
+
+def claim_orphans(base):
+    # Directoris amb segments pendents que cap procés viu té bloquejats (p. ex. d'un
+    # slot de worker que ja no existeix): algú els ha de buidar
+    orphans = []
+    for name in sorted(os.listdir(base)):
+        directory = os.path.join(base, name)
+        if not name.startswith("worker-") or not os.path.isdir(directory):
+            continue
+        if not any(entry.startswith(SEGMENT_PREFIX) and entry.endswith(SEGMENT_SUFFIX) for entry in os.listdir(directory)):
+            continue
+        lock = try_lock(directory + ".lock")
+        if lock is not None:
+            orphans.append((directory, lock))
+    return orphans
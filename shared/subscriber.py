@@ -1,7 +1,8 @@
 import pika
 import time
 
-from shared.publisher import QUEUE_NAME
+from shared.partitioning import assign_partitions
+from shared.publisher import QUEUE_NAME, QUEUE_ARGUMENTS, declare_partitions, partition_queue
 
 class Subscriber:
     def __init__(self):
@@ -17,6 +18,9 @@ class Subscriber:
             time.sleep(10)
             self.conn = pika.BlockingConnection(parameters)
         self.channel = self.conn.channel()
+        self.consumers = {}
+        self.declared = set()
+        self.prefetch = None
 
 
     def subscribe(self, callback):
@@ -24,7 +28,81 @@ class Subscriber:
         self.channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback, auto_ack=True)
         self.channel.start_consuming()
 
+    def subscribe_partitions(self, callback, membership, interval=5, prefetch=1000, batch=None, flush_interval=1.0):
+        # Consume only the partitions assigned to this worker and reassign them
+        # every `interval` seconds according to the live workers.
+        # With `batch` the acks are grouped and only sent after batch.flush()
+        self.last_tag = None
+
+        def on_message(ch, method, properties, body):
+            callback(ch, method, properties, body)
+            if batch is None:
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+            else:
+                self.last_tag = method.delivery_tag
+                if batch.full():
+                    self.flush(batch)
+
+        self.set_prefetch(prefetch)
+        declare_partitions(self.channel)
+        next_rebalance = 0
+        try:
+            while True:
+                if time.monotonic() >= next_rebalance:
+                    # Flush before giving partitions away so the new owner doesn't overtake our readings
+                    self.flush(batch)
+                    self.rebalance(on_message, membership)
+                    next_rebalance = time.monotonic() + interval
+                self.conn.process_data_events(time_limit=interval if batch is None else flush_interval)
+                self.flush(batch)
+        finally:
+            membership.leave()
+
+    def set_prefetch(self, prefetch):
+        # basic_qos only applies to consumers registered after it: it must come before basic_consume
+        if prefetch != self.prefetch:
+            self.channel.basic_qos(prefetch_count=prefetch)
+            self.prefetch = prefetch
+
+    def flush(self, batch):
+        if batch is None:
+            return
+        batch.flush()
+        if self.last_tag is not None:
+            self.channel.basic_ack(delivery_tag=self.last_tag, multiple=True)
+            self.last_tag = None
+
+    def rebalance(self, on_message, membership):
+        membership.heartbeat()
+        owned = set(assign_partitions(membership.worker_id, membership.members()))
+        for partition in set(self.consumers) - owned:
+            # Unacked messages go back to the queue in the same order
+            self.channel.basic_cancel(self.consumers.pop(partition))
+        for partition in owned - set(self.consumers):
+            self.consumers[partition] = self.channel.basic_consume(queue=partition_queue(partition), on_message_callback=on_message)
+        return sorted(owned)
+
+    def consume(self, queue, callback, prefetch=1):
+        # Job queue shared by every worker; the callback acks once its batch is done.
+        # A single unacked message per worker so the batches are spread across all of them
+        self.channel.queue_declare(queue=queue, durable=True)
+        self.set_prefetch(prefetch)
+        return self.channel.basic_consume(queue=queue, on_message_callback=callback)
+
+    def publish(self, queue, body):
+        # Publish from the consumer's own channel, e.g. the alert events
+        if queue not in self.declared:
+            self.channel.queue_declare(queue=queue, arguments=QUEUE_ARGUMENTS.get(queue))
+            self.declared.add(queue)
+        self.channel.basic_publish(exchange='', routing_key=queue, body=body)
+
+    def publish_job(self, queue, body):
+        # Like Publisher.publish_job: durable queue and persistent message
+        self.channel.queue_declare(queue=queue, durable=True)
+        self.channel.basic_publish(exchange='', routing_key=queue, body=body,
+                                   properties=pika.BasicProperties(delivery_mode=2))
+
     def close(self):
         self.conn.close()
 
-    
\ No newline at end of file
+
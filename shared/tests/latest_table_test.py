@@ -0,0 +1,45 @@
+from shared.latest_table import LatestTable, format_last_seen, to_micros
+
+
+def reading(last_seen="2020-01-01T00:00:00.000Z", temperature=21.5):
+    return {"last_seen": last_seen, "temperature": temperature, "humidity": None, "velocity": None, "battery_level": 0.5}
+
+def test_latest_table_write_read(tmp_path):
+    table = LatestTable(str(tmp_path / "latest"), capacity=10)
+    assert table.read(3) is None
+    assert table.write(3, reading())
+    assert table.read(3) == {"id": 3, "last_seen": "2020-01-01T00:00:00.000Z", "temperature": 21.5, "humidity": None, "velocity": None, "battery_level": 0.5}
+    assert not table.write(10, reading())
+    assert table.read(10) is None
+
+def test_latest_table_same_format_as_redis():
+    for last_seen in ["2020-01-01T00:00:00.000Z", "2020-01-01T00:00:00Z", "2020-01-01T01:00:00+01:00", "2020-01-01T00:00:00"]:
+        assert format_last_seen(to_micros(last_seen)) == "2020-01-01T00:00:00.000Z"
+    assert format_last_seen(to_micros("2020-01-01T00:00:00.123456Z")) == "2020-01-01T00:00:00.123456Z"
+
+def test_latest_table_shared_between_instances(tmp_path):
+    path = str(tmp_path / "latest")
+    LatestTable(path, capacity=10).write(1, reading(temperature=30.0))
+    assert LatestTable(path, capacity=10).read(1)["temperature"] == 30.0
+
+def test_latest_table_clear_and_invalidate(tmp_path):
+    table = LatestTable(str(tmp_path / "latest"), capacity=10)
+    table.write(1, reading())
+    table.write(2, reading())
+    seq = int(table.seq[1])
+    table.clear(1)
+    assert table.read(1) is None
+    assert int(table.seq[1]) == seq + 2
+    table.invalidate()
+    assert table.read(2) is None
+    table.write(2, reading(temperature=5.0))
+    assert table.read(2)["temperature"] == 5.0
+
+def test_latest_table_seqlock_write_in_progress(tmp_path):
+    table = LatestTable(str(tmp_path / "latest"), capacity=10)
+    table.write(1, reading())
+    # Un escriptor a mitges deixa el comptador senar: el lector no retorna res a mig escriure
+    table.seq[1] += 1
+    assert table.read(1, retries=5) is None
+    table.seq[1] += 1
+    assert table.read(1)["temperature"] == 21.5
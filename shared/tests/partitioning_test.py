@@ -0,0 +1,108 @@
+from collections import Counter
+
+from shared.partitioning import jump_hash, partition_for, assign_partitions
+from shared.subscriber import Subscriber
+
+
+def test_jump_hash_is_stable():
+    assert [jump_hash(key, 8) for key in range(10)] == [jump_hash(key, 8) for key in range(10)]
+    assert all(0 <= jump_hash(key, 8) < 8 for key in range(1000))
+    assert jump_hash(1234, 1) == 0
+
+def test_jump_hash_is_balanced():
+    counts = Counter(jump_hash(key, 8) for key in range(8000))
+    assert set(counts) == set(range(8))
+    assert min(counts.values()) > 800
+
+def test_jump_hash_minimal_movement():
+    # En passar de 8 a 9 particions només es mouen claus, i només cap a la nova
+    moved = [key for key in range(9000) if jump_hash(key, 8) != jump_hash(key, 9)]
+    assert all(jump_hash(key, 9) == 8 for key in moved)
+    assert 700 < len(moved) < 1300
+
+def test_partition_for_same_sensor():
+    assert partition_for(42, 8) == partition_for("42", 8)
+
+def test_assign_partitions_disjoint_cover():
+    workers = ["a", "b", "c"]
+    assigned = [assign_partitions(worker, workers, 16) for worker in workers]
+    flat = [p for partitions in assigned for p in partitions]
+    assert sorted(flat) == list(range(16))
+
+def test_assign_partitions_minimal_movement():
+    before = {worker: set(assign_partitions(worker, ["a", "b", "c"], 32)) for worker in ["a", "b", "c"]}
+    after = {worker: set(assign_partitions(worker, ["a", "b", "c", "d"], 32)) for worker in ["a", "b", "c", "d"]}
+    # Els workers que ja hi eren només perden particions, que van totes al nou
+    for worker in ["a", "b", "c"]:
+        assert after[worker] <= before[worker]
+    assert after["d"] == set().union(*before.values()) - set().union(*(after[w] for w in ["a", "b", "c"]))
+
+def test_assign_partitions_includes_self():
+    assert sorted(assign_partitions("solo", [], 4)) == [0, 1, 2, 3]
+
+
+class FakeChannel:
+    def __init__(self):
+        self.cancelled = []
+        self.consumed = []
+
+    def basic_consume(self, queue, on_message_callback):
+        self.consumed.append(queue)
+        return "tag-" + queue
+
+    def basic_cancel(self, tag):
+        self.cancelled.append(tag)
+
+
+class FakeMembership:
+    def __init__(self, worker_id, members):
+        self.worker_id = worker_id
+        self._members = members
+
+    def heartbeat(self):
+        pass
+
+    def members(self):
+        return self._members
+
+
+def test_rebalance_moves_only_changed_partitions():
+    subscriber = Subscriber.__new__(Subscriber)
+    subscriber.channel = FakeChannel()
+    subscriber.consumers = {}
+    owned = subscriber.rebalance(None, FakeMembership("a", ["a"]))
+    assert owned == list(range(len(owned))) and len(subscriber.channel.consumed) == len(owned)
+    subscriber.channel.consumed = []
+    kept = subscriber.rebalance(None, FakeMembership("a", ["a", "b"]))
+    assert set(kept) < set(owned)
+    assert subscriber.channel.consumed == []
+    assert sorted(subscriber.channel.cancelled) == sorted(f"tag-test.{p}" for p in set(owned) - set(kept))
+    assert sorted(subscriber.consumers) == kept
+
+
+class QosChannel(FakeChannel):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def queue_declare(self, queue, durable=False):
+        pass
+
+    def basic_qos(self, prefetch_count):
+        self.calls.append(("qos", prefetch_count))
+
+    def basic_consume(self, queue, on_message_callback):
+        self.calls.append(("consume", queue))
+        return super().basic_consume(queue, on_message_callback)
+
+def test_prefetch_is_set_before_every_consumer():
+    subscriber = Subscriber.__new__(Subscriber)
+    subscriber.channel = QosChannel()
+    subscriber.consumers = {}
+    subscriber.prefetch = None
+    subscriber.consume("jobs", None)
+    subscriber.set_prefetch(1000)
+    subscriber.rebalance(None, FakeMembership("a", ["a"]))
+    calls = subscriber.channel.calls
+    assert calls[:3] == [("qos", 1), ("consume", "jobs"), ("qos", 1000)]
+    assert all(kind == "consume" for kind, _ in calls[3:])
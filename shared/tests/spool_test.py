@@ -0,0 +1,169 @@
+import os
+
+import shared.spool as spool_module
+from shared.spool import HEADER, Spool, SpoolDrainer, SpoolReader, claim_directory, claim_orphans, claim_slot, segment_name
+
+
+def test_spool_append_read_commit(tmp_path):
+    spool = Spool(str(tmp_path), sync=False)
+    for i in range(5):
+        spool.append(i, f"reading {i}".encode())
+    reader = SpoolReader(spool)
+    records, offset = reader.read(3)
+    assert records == [(i, f"reading {i}".encode()) for i in range(3)]
+    reader.commit(offset, len(records))
+    records, offset = reader.read(10)
+    assert [sensor_id for sensor_id, _ in records] == [3, 4]
+    reader.commit(offset, len(records))
+    assert reader.depth_bytes() == 0
+    assert reader.read(10)[0] == []
+
+def test_spool_offset_survives_restart(tmp_path):
+    spool = Spool(str(tmp_path), sync=False)
+    for i in range(4):
+        spool.append(i, b"x")
+    reader = SpoolReader(spool)
+    records, offset = reader.read(2)
+    reader.commit(offset, len(records))
+    spool.close()
+    # Després de reiniciar s'obre un segment nou i es continua des de l'offset confirmat
+    spool = Spool(str(tmp_path), sync=False)
+    spool.append(9, b"y")
+    records, _ = SpoolReader(spool).read(10)
+    assert [sensor_id for sensor_id, _ in records] == [2, 3, 9]
+
+def test_spool_torn_tail_is_skipped(tmp_path):
+    spool = Spool(str(tmp_path), sync=False)
+    spool.append(1, b"complete")
+    spool.append(2, b"torn record")
+    spool.close()
+    path = os.path.join(str(tmp_path), segment_name(1))
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 4)
+    spool = Spool(str(tmp_path), sync=False)
+    spool.append(3, b"after restart")
+    reader = SpoolReader(spool)
+    records, offset = reader.read(10)
+    assert [sensor_id for sensor_id, _ in records] == [1, 3]
+    reader.commit(offset, len(records))
+    # El segment antic ja buidat s'esborra
+    assert spool.segments() == [2]
+
+def test_spool_corrupted_record_stops_reading(tmp_path):
+    spool = Spool(str(tmp_path), sync=False)
+    spool.append(1, b"good")
+    spool.append(2, b"bad!")
+    spool.close()
+    path = os.path.join(str(tmp_path), segment_name(1))
+    with open(path, "r+b") as f:
+        f.seek(2 * HEADER.size + 4)
+        f.write(b"BAD!")
+    records, _ = SpoolReader(Spool(str(tmp_path), sync=False)).read(10)
+    assert [sensor_id for sensor_id, _ in records] == [1]
+
+def test_spool_rotates_segments(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=64, sync=True)
+    for i in range(10):
+        spool.append(i, b"0123456789")
+    assert len(spool.segments()) > 1
+    records, _ = SpoolReader(spool).read(100)
+    assert [sensor_id for sensor_id, _ in records] == list(range(10))
+
+
+class FlakyPublisher:
+    def __init__(self, published, fail):
+        self.published = published
+        self.fail = fail
+
+    def publish_body(self, body, sensor_id):
+        if self.fail:
+            self.fail.pop()
+            raise ConnectionError("broker down")
+        self.published.append(sensor_id)
+
+    def close(self):
+        pass
+
+def test_drainer_commits_only_after_publish(tmp_path):
+    spool = Spool(str(tmp_path), sync=False)
+    for i in range(6):
+        spool.append(i, b"x")
+    published = []
+    fail = [True]
+    drainer = SpoolDrainer(spool, connect=lambda: FlakyPublisher(published, fail), batch=4, idle=0.01, retry=0.01)
+    drainer.start()
+    for _ in range(500):
+        if drainer.reader.drained == 6:
+            break
+        drainer.join(0.01)
+    drainer.stop()
+    # El primer intent falla: res no es confirma i el lot es torna a enviar sencer, en ordre
+    assert published == list(range(6))
+    assert drainer.reader.drained == 6
+    assert drainer.last_error == "broker down"
+
+def test_spool_reader_keeps_records_appended_while_reading(tmp_path, monkeypatch):
+    # Un fil de l'API afegeix registres i rota just quan el lector tanca el segment actiu
+    spool = Spool(str(tmp_path), segment_bytes=40, sync=False)
+    spool.append(1, b"first")
+    real_open = open
+
+    class Interleaved:
+        def __init__(self, f):
+            self.f = f
+
+        def __enter__(self):
+            return self.f
+
+        def __exit__(self, *exc):
+            self.f.close()
+            if spool.segment == 1:
+                spool.append(2, b"appended before rotating")
+                spool.append(3, b"after rotating")
+
+    def interleaved_open(path, mode="r"):
+        return Interleaved(real_open(path, mode)) if mode == "rb" else real_open(path, mode)
+
+    monkeypatch.setattr(spool_module, "open", interleaved_open, raising=False)
+    reader = SpoolReader(spool)
+    records, offset = reader.read(10)
+    reader.commit(offset, len(records))
+    monkeypatch.undo()
+    while True:
+        more, offset = reader.read(10)
+        if not more:
+            break
+        records += more
+        reader.commit(offset, len(more))
+    assert [sensor_id for sensor_id, _ in records] == [1, 2, 3]
+
+def test_orphan_spool_is_drained_and_released(tmp_path):
+    base = str(tmp_path)
+    # Un slot d'un worker que ja no existeix va deixar lectures al spool
+    orphan = Spool(os.path.join(base, "worker-3"), sync=False)
+    for i in range(3):
+        orphan.append(i, b"x")
+    orphan.close()
+    directory, lock = claim_directory(base)
+    assert directory == os.path.join(base, "worker-0")
+    Spool(directory, lock=lock, sync=False)
+    orphans = claim_orphans(base)
+    assert [path for path, _ in orphans] == [os.path.join(base, "worker-3")]
+    published = []
+    (path, orphan_lock), = orphans
+    drainer = SpoolDrainer(Spool(path, lock=orphan_lock, sync=False), connect=lambda: FlakyPublisher(published, []), idle=0.01, until_empty=True)
+    drainer.start()
+    drainer.join(5)
+    assert not drainer.is_alive()
+    assert published == [0, 1, 2]
+    assert os.listdir(path) == []
+    # Buit i sense lock: ja no és orfe
+    assert claim_orphans(base) == []
+
+def test_claim_slot_is_reused_after_restart(tmp_path):
+    first, first_lock = claim_slot(str(tmp_path))
+    second, second_lock = claim_slot(str(tmp_path))
+    assert (first, second) == (0, 1)
+    # El procés del slot 0 cau: el següent que arrenca torna a ser el 0
+    first_lock.close()
+    assert claim_slot(str(tmp_path))[0] == 0
@@ -22,8 +22,8 @@ class Timescale:
     def ping(self):
         return self.conn.ping()
     
-    def execute(self, query):
-       return self.cursor.execute(query)
+    def execute(self, query, params=None):
+       return self.cursor.execute(query, params)
     
     def delete(self, table):
         self.cursor.execute("DELETE FROM " + table)